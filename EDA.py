@@ -1,8 +1,13 @@
 import sqlite3
 import pandas as pd
 import numpy as np
-from transformers import BertTokenizer, BertModel
-from sklearn.decomposition import PCA
+from embedding_engine import EmbeddingEngine, build_embedding_matrix, check_alignment
+from embedding_cache import EmbeddingCache, cached_encode
+from vector_index import IVFIndex, knn_graph, normalize
+from reduction import Projection, QuantizedMatrix
+from lexical_index import LexicalIndex
+from review_stats import create_review_stats_tables, load_review_stats, update_review_stats
+from artifacts import write_bundle
 
 def main():
     # Connect to the database
@@ -30,8 +35,17 @@ def main():
     # Load the data into pandas DataFrames
     print(f"Loading data from table: {game_table}")
     games_df = pd.read_sql_query(f"SELECT * FROM {game_table}", conn)
-    print(f"Loading data from table: {review_table}")
-    reviews_df = pd.read_sql_query(f"SELECT * FROM {review_table}", conn)
+    # Reviews are never loaded wholesale: only their per-game aggregates, brought up to date with new reviews first
+    print(f"Aggregating new rows of table: {review_table}")
+    create_review_stats_tables(conn.cursor())
+    conn.commit()
+    print(f"Review stats updated for {update_review_stats(conn)} games.")
+    review_stats_df = load_review_stats(conn)
+    # Genres back the recommendation filters; databases built before the table existed have none
+    try:
+        genres_df = pd.read_sql_query("SELECT appid, genre FROM game_genres", conn)
+    except pd.errors.DatabaseError:
+        genres_df = None
     
     # Close the connection
     conn.close()
@@ -43,40 +57,58 @@ def main():
     filtered_games_df.to_csv('filtered_games_df.csv', index=False)
     print(f"Filtered games saved to 'filtered_games_df.csv'. Number of filtered games: {filtered_games_df.shape[0]}")
     
-    # Filter reviews based on the filtered games_df appid
-    print("Filtering reviews based on the filtered games_df appid...")
-    filtered_reviews_df = reviews_df[reviews_df['appid'].isin(filtered_games_df['appid'])]
+    # The BERT model and tokenizer are only loaded if some description is not in the embedding cache
+    embedding_engine = EmbeddingEngine()
+    embedding_cache = EmbeddingCache.for_engine(embedding_engine)
     
-    # Load pre-trained BERT model and tokenizer
-    print("Loading pre-trained BERT model and tokenizer...")
-    bert_tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-    bert_model = BertModel.from_pretrained('bert-base-uncased')
-    
-    # Function to get text embedding
-    def get_embedding(text):
-        inputs = bert_tokenizer(text, return_tensors='pt', truncation=True, padding=True, max_length=512)
-        outputs = bert_model(**inputs)
-        return outputs.last_hidden_state.mean(dim=1).cpu().detach().numpy()
-    
-    # Generate embeddings for all game descriptions
+    # Generate embeddings for all game descriptions, chunk by chunk straight into the .npy on disk.
+    # A killed run resumes from the manifest written next to the matrix.
     print("Generating embeddings for all game descriptions...")
-    embeddings = []
-    for idx, description in enumerate(filtered_games_df['description']):
-        embeddings.append(get_embedding(description).flatten())
-        if idx % 100 == 0:
-            print(f"Processed {idx} descriptions...")
-    
-    # Convert to numpy array and save
-    bert_item_feature_matrix = np.array(embeddings)
-    np.save('bert_item_feature_matrix.npy', bert_item_feature_matrix)
+    bert_item_feature_matrix = build_embedding_matrix(
+        embedding_engine,
+        filtered_games_df['description'].fillna('').tolist(),
+        filtered_games_df['appid'].to_numpy(),
+        'bert_item_feature_matrix.npy',
+        encode_chunk=lambda texts: cached_encode(embedding_engine, embedding_cache, texts),
+    )
+    print(f"Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} descriptions embedded.")
+    embedding_cache.close()
     print("BERT item feature matrix saved to 'bert_item_feature_matrix.npy'.")
+    if not check_alignment('bert_item_feature_matrix.npy', filtered_games_df['appid']):
+        raise RuntimeError("bert_item_feature_matrix.npy rows do not line up with filtered_games_df.csv")
     
-    # Perform PCA on the embeddings
+    # Fit PCA on the embeddings and keep the projection, so queries are mapped into the same space
     print("Performing PCA on the embeddings...")
-    pca = PCA(n_components=768)
-    reduced_item_feature_matrix = pca.fit_transform(bert_item_feature_matrix)
+    projection = Projection.fit(bert_item_feature_matrix)
+    reduced_item_feature_matrix = projection.transform(bert_item_feature_matrix)
     np.save('reduced_item_feature_matrix.npy', reduced_item_feature_matrix)
-    print("Reduced item feature matrix saved to 'reduced_item_feature_matrix.npy'.")
+    print(f"PCA to {projection.dim} dimensions keeps {projection.explained_variance_ratio.sum():.1%} of the variance.")
+
+    # The app searches unit-length reduced vectors stored as int8 with one scale per row
+    item_vectors = QuantizedMatrix.quantize(normalize(reduced_item_feature_matrix))
+    print(f"Item vectors take {item_vectors.nbytes / 2**20:.1f} MiB "
+          f"({bert_item_feature_matrix.nbytes / 2**20:.1f} MiB at full precision).")
+
+    # Build the approximate nearest-neighbour index the app searches instead of scanning every game
+    print("Building IVF index over the item vectors...")
+    item_index = IVFIndex.build(item_vectors)
+    print(f"Item index with {len(item_index.centroids)} lists built.")
+
+    # "More like this" is answered from a precomputed neighbour table, without the model
+    print("Computing item-to-item neighbours...")
+    neighbours = knn_graph(item_vectors, verbose=True)
+    print(f"{neighbours[0].shape[1]} neighbours per game computed.")
+
+    # Keyword queries are matched against a BM25 index over names, descriptions, developers and tags
+    print("Building lexical index over the game text...")
+    lexical_index = LexicalIndex.build(filtered_games_df)
+    print(f"Lexical index with {len(lexical_index)} terms built.")
+
+    # Everything the app serves goes into one versioned bundle: catalogue columns, projection, vectors, index and neighbours
+    # Review counts and ratios ride along in the catalogue and become each game's ranking prior
+    catalogue_df = filtered_games_df.merge(review_stats_df, on='appid', how='left')
+    bundle_path = write_bundle(catalogue_df, projection, item_vectors, item_index, neighbours, genres_df, lexical_index)
+    print(f"Artifact bundle written to '{bundle_path}' and made current.")
 
 if __name__ == "__main__":
     main()
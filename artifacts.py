@@ -0,0 +1,185 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from lexical_index import LexicalIndex
+from reduction import Projection, QuantizedMatrix
+from review_stats import item_priors
+from vector_index import load_index
+
+ARTIFACTS_DIR = 'artifacts'
+CURRENT_FILE = 'CURRENT'  # holds the version of the bundle the app serves
+CATALOGUE_FILE = 'catalogue.feather'
+CATALOGUE_COLUMNS = ('appid', 'name', 'price', 'release_date', 'description', 'price_cents', 'currency', 'release_epoch',
+                     'review_count', 'positive_ratio')
+DESCRIPTION_CHARS = 250  # the app only ever shows this much of a description
+PROJECTION_FILE = 'pca_projection.npz'
+STORE_PREFIX = 'item_vectors'
+INDEX_FILE = 'item_index.npz'
+NEIGHBOURS_PREFIX = 'neighbours'  # neighbours.rows.npy and neighbours.scores.npy
+APPID_ROWS_FILE = 'appid_rows.npy'  # direct-address appid -> row table, -1 where there is no item
+GENRES_FILE = 'genres.npz'  # genre -> item rows, as names + CSR offsets/rows
+LEXICAL_PREFIX = 'lexical'  # BM25 postings: lexical.terms/offsets/rows/weights.npy
+ITEM_PRIORS_FILE = 'item_priors.npy'  # per-item popularity/quality prior in [0, 1], from review_stats
+MANIFEST_FILE = 'manifest.json'
+
+
+def new_version():
+    return time.strftime('%Y%m%d-%H%M%S')
+
+
+def write_catalogue(path, games_df):
+    # Uncompressed Arrow IPC, so readers memory-map it instead of parsing it
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    catalogue = games_df.reindex(columns=list(CATALOGUE_COLUMNS))
+    catalogue['appid'] = catalogue['appid'].astype('int64')
+    # Typed filter columns stay nullable: unknown prices and dates match no range filter
+    for column in ('price_cents', 'release_epoch', 'review_count'):
+        catalogue[column] = catalogue[column].astype('Int64')
+    catalogue['positive_ratio'] = catalogue['positive_ratio'].astype('float64')
+    catalogue['currency'] = catalogue['currency'].astype('string')
+    descriptions = catalogue['description'].fillna('').astype(str)
+    catalogue['description'] = descriptions.where(descriptions.str.len() <= DESCRIPTION_CHARS,
+                                                  descriptions.str.slice(0, DESCRIPTION_CHARS) + '...')
+    for column in ('name', 'price', 'release_date'):
+        catalogue[column] = catalogue[column].fillna('').astype(str)
+    feather.write_feather(pa.Table.from_pandas(catalogue, preserve_index=False), path, compression='uncompressed')
+
+
+def write_appid_rows(path, appids):
+    appids = np.asarray(appids, dtype=np.int64)
+    table = np.full(int(appids.max()) + 1 if len(appids) else 0, -1, dtype=np.int32)
+    table[appids] = np.arange(len(appids), dtype=np.int32)
+    np.save(path, table)
+
+
+def write_genres(path, appids, genres_df):
+    # genres_df has one (appid, genre) row per genre of a game, as in the game_genres table
+    row_of = {appid: row for row, appid in enumerate(appids)}
+    genres_df = genres_df.assign(row=genres_df['appid'].map(row_of)).dropna(subset=['row']).sort_values(['genre', 'row'])
+    names, counts = np.unique(genres_df['genre'].to_numpy(dtype=str), return_counts=True)
+    np.savez(path, names=names, offsets=np.concatenate([[0], np.cumsum(counts)]),
+             rows=genres_df['row'].to_numpy(dtype=np.int32))
+
+
+def write_bundle(games_df, projection, item_vectors, item_index, neighbours=None, genres_df=None, lexical_index=None,
+                 root=ARTIFACTS_DIR, version=None):
+    """Writes one self-contained artifact version and makes it the current one.
+
+    Rows of the catalogue and the item vectors line up by construction. The
+    CURRENT pointer is swapped last, so readers only ever see complete bundles.
+    """
+    version = version or new_version()
+    path = os.path.join(root, version)
+    os.makedirs(path, exist_ok=True)
+    write_catalogue(os.path.join(path, CATALOGUE_FILE), games_df)
+    projection.save(os.path.join(path, PROJECTION_FILE))
+    item_vectors.save(os.path.join(path, STORE_PREFIX))
+    item_index.save(os.path.join(path, INDEX_FILE))
+    write_appid_rows(os.path.join(path, APPID_ROWS_FILE), games_df['appid'])
+    if genres_df is not None:
+        write_genres(os.path.join(path, GENRES_FILE), games_df['appid'], genres_df)
+    if neighbours is not None:
+        np.save(os.path.join(path, f'{NEIGHBOURS_PREFIX}.rows.npy'), neighbours[0])
+        np.save(os.path.join(path, f'{NEIGHBOURS_PREFIX}.scores.npy'), neighbours[1])
+    if lexical_index is not None:
+        lexical_index.save(os.path.join(path, LEXICAL_PREFIX))
+    # Games merged with their review_stats rows carry review counts; games without reviews get a prior of 0
+    has_priors = 'review_count' in games_df and 'positive_count' in games_df
+    if has_priors:
+        np.save(os.path.join(path, ITEM_PRIORS_FILE), item_priors(games_df['review_count'].fillna(0), games_df['positive_count'].fillna(0)))
+    manifest = {
+        'version': version,
+        'rows': len(item_vectors),
+        'dim': int(item_vectors.shape[1]),
+        'dtype': str(item_vectors.codes.dtype),
+        'neighbours': int(neighbours[0].shape[1]) if neighbours is not None else 0,
+        'lexical_terms': len(lexical_index) if lexical_index is not None else 0,
+        'item_priors': has_priors,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    current = os.path.join(root, CURRENT_FILE)
+    with open(current + '.tmp', 'w') as file:
+        file.write(version)
+    os.replace(current + '.tmp', current)
+    return path
+
+
+def current_version(root=ARTIFACTS_DIR):
+    with open(os.path.join(root, CURRENT_FILE)) as file:
+        return file.read().strip()
+
+
+class Bundle:
+    """Read side of an artifact version; every large file is memory-mapped read-only.
+
+    Worker processes opening the same bundle share its pages through the OS
+    cache, and opening it costs the same whatever the catalogue size.
+    """
+
+    def __init__(self, root=ARTIFACTS_DIR, version=None):
+        self.version = version or current_version(root)
+        self.path = os.path.join(root, self.version)
+        with open(os.path.join(self.path, MANIFEST_FILE)) as file:
+            self.manifest = json.load(file)
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def catalogue(self):
+        import pyarrow.feather as feather
+
+        table = feather.read_table(self.file(CATALOGUE_FILE), memory_map=True)
+        if table.num_rows != self.manifest['rows']:
+            raise ValueError(f"{self.file(CATALOGUE_FILE)} has {table.num_rows} rows, the manifest {self.manifest['rows']}")
+        return table
+
+    def projection(self):
+        return Projection.load(self.file(PROJECTION_FILE))
+
+    def item_vectors(self):
+        return QuantizedMatrix.load(self.file(STORE_PREFIX), mmap_mode='r')
+
+    def item_index(self, item_vectors=None):
+        return load_index(item_vectors if item_vectors is not None else self.item_vectors(), self.file(INDEX_FILE), mmap_mode='r')
+
+    def appid_rows(self):
+        return np.load(self.file(APPID_ROWS_FILE), mmap_mode='r')
+
+    def genres(self):
+        # {genre: sorted item rows}; empty when the bundle was built without genres
+        if not os.path.exists(self.file(GENRES_FILE)):
+            return {}
+        data = np.load(self.file(GENRES_FILE))
+        offsets, rows = data['offsets'], data['rows']
+        return {str(name): rows[offsets[i]:offsets[i + 1]] for i, name in enumerate(data['names'])}
+
+    def neighbours(self):
+        # (rows, scores) of each item's precomputed neighbours, or None when the bundle has none
+        if not self.manifest.get('neighbours'):
+            return None
+        return (np.load(self.file(f'{NEIGHBOURS_PREFIX}.rows.npy'), mmap_mode='r'),
+                np.load(self.file(f'{NEIGHBOURS_PREFIX}.scores.npy'), mmap_mode='r'))
+
+    def item_priors(self):
+        # None when the bundle was built without review stats
+        if not self.manifest.get('item_priors'):
+            return None
+        return np.load(self.file(ITEM_PRIORS_FILE), mmap_mode='r')
+
+    def lexical_index(self):
+        # BM25 postings, memory-mapped; None when the bundle was built without them
+        if not self.manifest.get('lexical_terms'):
+            return None
+        return LexicalIndex.load(self.file(LEXICAL_PREFIX), mmap_mode='r')
+
+
+def catalogue_rows(catalogue, rows):
+    # Catalogue rows as dicts, in the order given; only the requested rows are materialised
+    return catalogue.take(np.asarray(rows, dtype=np.int64)).to_pylist()
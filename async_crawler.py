@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from tqdm import tqdm
+
+from crawl_state import CRAWL_ORDERS, import_processed_ids, iter_pending_appids, prepare_pending
+from db_writer import DBWriter, connect
+from review_stats import update_review_stats
+from fetch_data import (
+    DETAILS_URL,
+    MAX_RETRIES,
+    MAX_REVIEWS_PER_GAME,
+    RATE_LIMIT_BACKOFF,
+    REQUEST_TIMEOUT,
+    REVIEWS_URL,
+    create_tables,
+    details_limiter,
+    fetch_app_list,
+    logger,
+    parse_app_details,
+    parse_app_reviews,
+    review_page_params,
+    reviews_limiter,
+    select_new_reviews,
+)
+
+MAX_IN_FLIGHT = 200  # Number of apps being fetched concurrently
+POOL_SIZE = 32  # Persistent connections kept open to the store
+KEEPALIVE_TIMEOUT = 60  # seconds an idle pooled connection is kept
+APPID_PREFETCH = 1000  # pending appids read from SQLite per trip to the reader thread
+
+async def fetch_app_details_async(session, appid):
+    http_status = None
+    for attempt in range(MAX_RETRIES):
+        try:
+            await details_limiter.acquire_async()
+            async with session.get(DETAILS_URL, params={'appids': appid}) as response:
+                http_status = response.status
+                if response.status == 429:  # Too Many Requests
+                    details_limiter.on_throttle()
+                    logger.warning(f"Rate limit exceeded for appid {appid}. Retrying after delay (rate now {details_limiter.rate:.2f}/s).")
+                    sleep_time = RATE_LIMIT_BACKOFF * (2 ** attempt) + random.uniform(0.5, 1.5)
+                    await asyncio.sleep(sleep_time)
+                    continue
+                response.raise_for_status()
+                details_limiter.on_success()
+                data = await response.json(content_type=None)
+            game_data = parse_app_details(appid, data)
+            if game_data is None:
+                logger.warning(f"Failed to fetch game details for appid: {appid}")
+            return game_data, http_status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Attempt {attempt + 1} failed for appid {appid}: {e!r}")
+            await asyncio.sleep(2 ** attempt + random.uniform(0.5, 1.5))
+    return None, http_status
+
+async def fetch_app_reviews_async(session, read, appid, on_page, max_reviews=MAX_REVIEWS_PER_GAME, incremental=False):
+    cursor = '*'
+    fetched = 0
+    throttled = 0
+    try:
+        while fetched < max_reviews:
+            await reviews_limiter.acquire_async()
+            async with session.get(f"{REVIEWS_URL}/{appid}", params=review_page_params(cursor)) as response:
+                if response.status == 429:
+                    reviews_limiter.on_throttle()
+                    logger.warning(f"Rate limit exceeded fetching reviews for appid {appid} (rate now {reviews_limiter.rate:.2f}/s).")
+                    throttled += 1
+                    if throttled >= MAX_RETRIES:
+                        break
+                    continue
+                reviews_limiter.on_success()
+                data = await response.json(content_type=None)
+            if 'reviews' not in data:
+                logger.warning(f"Failed to fetch reviews for appid: {appid}")
+                break
+            reviews, done = await read(select_new_reviews, parse_app_reviews(appid, data), fetched, max_reviews, incremental)
+            if reviews:
+                await on_page(reviews)
+                fetched += len(reviews)
+            next_cursor = data.get('cursor')
+            if done or not data['reviews'] or not next_cursor or next_cursor == cursor:
+                break
+            cursor = next_cursor
+    except Exception as e:
+        logger.error(f"Error fetching reviews for appid: {appid} - {e!r}")
+    return fetched
+
+# Same steps as fetch_data.fetch_data, on the shared session; on_reviews is a coroutine function
+async def fetch_data_async(session, read, appid, on_reviews, max_reviews=MAX_REVIEWS_PER_GAME, incremental=False):
+    game_data, http_status = await fetch_app_details_async(session, appid)
+    if game_data:
+        await fetch_app_reviews_async(session, read, appid, on_reviews, max_reviews=max_reviews, incremental=incremental)
+    return game_data, http_status
+
+async def crawl(appids, read_conn, max_in_flight=MAX_IN_FLIGHT, pool_size=POOL_SIZE, total=None,
+                max_reviews=MAX_REVIEWS_PER_GAME, incremental=False):
+    # SQLite writes go through the writer thread. Its queue is bounded, so a hand-off can wait for space;
+    # that wait happens on an executor thread, and a lagging writer slows the crawl without stalling the event loop
+    writer = DBWriter()
+    writer.start()
+    loop = asyncio.get_running_loop()
+    # SQLite reads (pending appids, stored review ids) run on one reader thread that owns read_conn
+    reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-reader')
+    processed = 0
+
+    async def read(query, *args):
+        return await loop.run_in_executor(reader, query, read_conn, *args)
+
+    async def submit(appid, game_data, http_status):
+        await loop.run_in_executor(None, writer.submit, appid, game_data, http_status)
+
+    async def submit_reviews(reviews):
+        await loop.run_in_executor(None, writer.submit_reviews, reviews)
+
+    connector = aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=KEEPALIVE_TIMEOUT, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    appid_iter = iter(appids)
+    pending = deque()
+    refill = asyncio.Lock()
+
+    async def next_appid():
+        # Workers share one iterator, advanced a chunk at a time on the reader thread
+        async with refill:
+            if not pending:
+                pending.extend(await loop.run_in_executor(reader, lambda: list(itertools.islice(appid_iter, APPID_PREFETCH))))
+            return pending.popleft() if pending else None
+
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            with tqdm(total=total) as pbar:
+                async def worker():
+                    nonlocal processed
+                    # Each worker holds one app at a time, so at most max_in_flight apps are in progress
+                    while (appid := await next_appid()) is not None:
+                        try:
+                            game_data, http_status = await fetch_data_async(
+                                session, read, appid, submit_reviews, max_reviews=max_reviews, incremental=incremental)
+                            await submit(appid, game_data, http_status)
+                        except Exception as e:
+                            await submit(appid, None, None)
+                            logger.warning(f"Failed to fetch details for appid: {appid} - {e!r}")
+                        processed += 1
+                        pbar.update(1)
+
+                await asyncio.gather(*(worker() for _ in range(max_in_flight)))
+    finally:
+        reader.shutdown()
+        writer.close()
+    return processed
+
+def main(offset=0, order='listed', max_in_flight=MAX_IN_FLIGHT, pool_size=POOL_SIZE,
+         max_reviews=MAX_REVIEWS_PER_GAME, incremental=False):
+    create_tables()
+    # Used from the crawl's reader thread, never from two threads at once
+    conn = connect(check_same_thread=False)
+    import_processed_ids(conn)
+    total_apps = prepare_pending(conn, fetch_app_list(), offset, order)
+
+    start = time.perf_counter()
+    try:
+        processed = asyncio.run(crawl(iter_pending_appids(conn), conn, max_in_flight=max_in_flight, pool_size=pool_size,
+                                      total=total_apps, max_reviews=max_reviews, incremental=incremental))
+        elapsed = time.perf_counter() - start
+        logger.info(f"Async crawl complete: {processed} apps in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.2f} apps/s).")
+        # Only the reviews stored by this run are aggregated
+        logger.info(f"Review stats updated for {update_review_stats(conn)} games.")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Crawl Steam app details and reviews on a single event loop.")
+    parser.add_argument('--offset', type=int, default=0, help="skip this many distinct appids of the ordered app list")
+    parser.add_argument('--order', choices=CRAWL_ORDERS, default='listed', help="order in which appids are crawled")
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT, help="apps in progress at once")
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE, help="persistent connections to the store")
+    parser.add_argument('--max-reviews', type=int, default=MAX_REVIEWS_PER_GAME, help="reviews fetched per game at most")
+    parser.add_argument('--incremental', action='store_true', help="stop paging a game's reviews at the first one already stored")
+    args = parser.parse_args()
+    main(offset=args.offset, order=args.order, max_in_flight=args.max_in_flight, pool_size=args.pool_size,
+         max_reviews=args.max_reviews, incremental=args.incremental)
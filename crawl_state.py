@@ -0,0 +1,201 @@
+import logging
+import os
+import time
+
+PROCESSED_IDS_FILE = 'processed_ids.txt'  # Checkpoint file used before crawl_state existed
+MISS_RECHECK_DAYS = 30  # Apps Steam reports as missing (success: false) are re-checked after this many days
+RETRY_BASE = 3600  # seconds before the first retry of a transient failure, doubled per consecutive failure
+RETRY_MAX = 7 * 86400  # upper bound on the transient retry delay
+
+# Failure reasons recorded in crawl_state.reason
+NOT_FOUND = 'not_found'  # appdetails answered success: false (DLC stubs, delisted or hidden apps)
+RATE_LIMITED = 'rate_limited'  # still 429 after MAX_RETRIES
+HTTP_ERROR = 'http_error'  # any other non-200 answer
+NETWORK_ERROR = 'network_error'  # no answer at all (timeouts, connection errors)
+PERMANENT_REASONS = (NOT_FOUND,)
+
+logger = logging.getLogger(__name__)
+
+_ORDER_BY = {
+    'listed': 'pos',
+    'newest': 'appid DESC',
+    'oldest': 'appid',
+}
+CRAWL_ORDERS = tuple(_ORDER_BY)
+
+def create_crawl_state_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_state (
+            appid INTEGER PRIMARY KEY,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_fetched INTEGER,
+            http_status INTEGER,
+            reason TEXT,
+            failures INTEGER NOT NULL DEFAULT 0,
+            next_attempt INTEGER,
+            price_fetched INTEGER
+        )
+    ''')
+    # Tables created before the failure ledger existed
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(crawl_state)')}
+    for column, definition in (('reason', 'TEXT'), ('failures', 'INTEGER NOT NULL DEFAULT 0'), ('next_attempt', 'INTEGER'),
+                               ('price_fetched', 'INTEGER')):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE crawl_state ADD COLUMN {column} {definition}')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_crawl_state_status ON crawl_state (status, next_attempt)')
+
+def classify_result(game_data, http_status):
+    # Returns (status, reason) for one fetch
+    if game_data:
+        return 'done', None
+    if http_status == 200:
+        return 'failed', NOT_FOUND
+    if http_status == 429:
+        return 'failed', RATE_LIMITED
+    if http_status is None:
+        return 'failed', NETWORK_ERROR
+    return 'failed', HTTP_ERROR
+
+def record_results(cursor, results, now=None):
+    # results: (appid, status, http_status, reason) rows, written in the caller's transaction.
+    # Permanent misses are deferred for MISS_RECHECK_DAYS; transient failures back off
+    # exponentially in the number of consecutive failures.
+    now = int(now or time.time())
+    permanent = ', '.join(f"'{reason}'" for reason in PERMANENT_REASONS)
+    params = []
+    for appid, status, http_status, reason in results:
+        if status == 'done':
+            next_attempt = None
+        elif reason in PERMANENT_REASONS:
+            next_attempt = now + MISS_RECHECK_DAYS * 86400
+        else:
+            next_attempt = now + RETRY_BASE
+        params.append({'appid': appid, 'status': status, 'now': now, 'http_status': http_status,
+                       'reason': reason, 'next_attempt': next_attempt, 'failed': int(status != 'done'),
+                       'price_fetched': now if status == 'done' else None})
+    cursor.executemany(f'''
+        INSERT INTO crawl_state (appid, status, attempts, last_fetched, http_status, reason, failures, next_attempt, price_fetched)
+        VALUES (:appid, :status, 1, :now, :http_status, :reason, :failed, :next_attempt, :price_fetched)
+        ON CONFLICT(appid) DO UPDATE SET
+            status = excluded.status,
+            attempts = crawl_state.attempts + 1,
+            last_fetched = excluded.last_fetched,
+            price_fetched = IFNULL(excluded.price_fetched, crawl_state.price_fetched),
+            http_status = excluded.http_status,
+            reason = excluded.reason,
+            failures = CASE WHEN excluded.status = 'done' THEN 0 ELSE crawl_state.failures + 1 END,
+            next_attempt = CASE
+                WHEN excluded.status = 'done' OR excluded.reason IN ({permanent}) THEN excluded.next_attempt
+                ELSE excluded.last_fetched + MIN({RETRY_MAX}, {RETRY_BASE} << MIN(crawl_state.failures, 16))
+            END
+    ''', params)
+
+def record_price_checks(cursor, appids, now=None):
+    cursor.executemany('UPDATE crawl_state SET price_fetched = ? WHERE appid = ?',
+                       [(int(now or time.time()), appid) for appid in appids])
+
+def import_processed_ids(conn, path=PROCESSED_IDS_FILE):
+    # One-off migration of the old text checkpoint; the file is renamed once imported
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r') as file:
+        rows = [(int(line),) for line in file if line.strip()]
+    conn.executemany('''
+        INSERT OR IGNORE INTO crawl_state (appid, status, attempts, http_status) VALUES (?, 'done', 1, 200)
+    ''', rows)
+    conn.commit()
+    os.replace(path, path + '.imported')
+    logger.info(f"Imported {len(rows)} processed appids from {path} into crawl_state.")
+    return len(rows)
+
+def prepare_pending(conn, app_list, offset=0, order='listed', now=None, details_max_age=None):
+    # Stages the fetched app list in temp tables; pending work is a single indexed anti-join
+    # against crawl_state. Apps whose failure ledger entry is not yet due are left out.
+    # With details_max_age (seconds), crawled apps fetched longer ago than that are re-crawled.
+    # Returns the number of appids left to crawl.
+    now = int(now or time.time())
+    stale_before = now - details_max_age if details_max_age is not None else None
+    if order not in _ORDER_BY:
+        raise ValueError(f"Unknown crawl order: {order}")
+    order_by = _ORDER_BY[order]
+    conn.execute('DROP TABLE IF EXISTS temp.app_list')
+    conn.execute('DROP TABLE IF EXISTS temp.pending')
+    conn.execute('CREATE TEMP TABLE app_list (pos INTEGER PRIMARY KEY, appid INTEGER NOT NULL)')
+    conn.executemany('INSERT INTO temp.app_list (appid) VALUES (?)', ((app['appid'],) for app in app_list))
+    # The app list contains duplicate entries; each appid is kept at its first position
+    conn.execute(f'''
+        CREATE TEMP TABLE pending AS
+        WITH ordered AS (
+            SELECT appid, MIN(pos) AS pos FROM temp.app_list GROUP BY appid
+            ORDER BY {order_by} LIMIT -1 OFFSET ?
+        )
+        SELECT ordered.appid AS appid, ordered.pos AS pos FROM ordered
+        LEFT JOIN crawl_state ON crawl_state.appid = ordered.appid
+        WHERE crawl_state.status IS NULL
+           OR (crawl_state.status != 'done' AND (crawl_state.next_attempt IS NULL OR crawl_state.next_attempt <= ?))
+           OR (crawl_state.status = 'done' AND IFNULL(crawl_state.last_fetched, 0) < ?)
+        ORDER BY {order_by}
+    ''', (offset, now, stale_before))
+    deferred = conn.execute('''
+        SELECT crawl_state.reason, COUNT(*) FROM (SELECT DISTINCT appid FROM temp.app_list) listed
+        JOIN crawl_state ON crawl_state.appid = listed.appid
+        WHERE crawl_state.status != 'done' AND crawl_state.next_attempt > ?
+        GROUP BY crawl_state.reason
+    ''', (now,)).fetchall()
+    if deferred:
+        skipped = sum(count for _, count in deferred)
+        breakdown = ', '.join(f"{reason}: {count}" for reason, count in deferred)
+        logger.info(f"Failure ledger defers {skipped} appids ({breakdown}), saving at least {skipped} appdetails requests this run.")
+    conn.commit()
+    return conn.execute('SELECT COUNT(*) FROM temp.pending').fetchone()[0]
+
+def prepare_price_refresh(conn, price_max_age, now=None):
+    # Crawled apps in the staged app list whose price is older than price_max_age seconds and
+    # that are not re-crawled in full anyway. Must run after prepare_pending.
+    now = int(now or time.time())
+    conn.execute('DROP TABLE IF EXISTS temp.price_refresh')
+    conn.execute('''
+        CREATE TEMP TABLE price_refresh AS
+        SELECT crawl_state.appid AS appid FROM (SELECT DISTINCT appid FROM temp.app_list) listed
+        JOIN crawl_state ON crawl_state.appid = listed.appid
+        WHERE crawl_state.status = 'done'
+          AND IFNULL(crawl_state.price_fetched, IFNULL(crawl_state.last_fetched, 0)) < ?
+          AND crawl_state.appid NOT IN (SELECT appid FROM temp.pending)
+        ORDER BY crawl_state.appid
+    ''', (now - price_max_age,))
+    conn.commit()
+    return conn.execute('SELECT COUNT(*) FROM temp.price_refresh').fetchone()[0]
+
+def iter_pending_appids(conn, chunk_size=1000, table='pending'):
+    # Pages through a temp table with short queries, so neither a Python set of appids nor a
+    # long-lived read transaction on steam_games.db is kept for the length of the crawl
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            f'SELECT rowid, appid FROM temp.{table} WHERE rowid > ? ORDER BY rowid LIMIT ?',
+            (last_rowid, chunk_size)).fetchall()
+        if not rows:
+            return
+        for last_rowid, appid in rows:
+            yield appid
+
+def ledger_report(conn, details_rate=None, now=None):
+    # Summarises the failure ledger and the request budget it saves on the next run
+    now = int(now or time.time())
+    rows = conn.execute('''
+        SELECT reason, COUNT(*), SUM(next_attempt > ?), SUM(attempts), MIN(CASE WHEN next_attempt > ? THEN next_attempt END)
+        FROM crawl_state WHERE status != 'done'
+        GROUP BY reason ORDER BY COUNT(*) DESC
+    ''', (now, now)).fetchall()
+    done = conn.execute("SELECT COUNT(*) FROM crawl_state WHERE status = 'done'").fetchone()[0]
+    lines = [f"{'reason':<16}{'apps':>10}{'deferred':>10}{'attempts':>10}  next due"]
+    for reason, count, deferred, attempts, next_due in rows:
+        due = time.strftime('%Y-%m-%d %H:%M', time.localtime(next_due)) if next_due else '-'
+        lines.append(f"{reason or 'unknown':<16}{count:>10}{deferred or 0:>10}{attempts:>10}  {due}")
+    deferred_total = sum(row[2] or 0 for row in rows)
+    lines.append(f"{done} apps crawled; {deferred_total} failed apps are skipped until they are due.")
+    if details_rate:
+        lines.append(f"That saves at least {deferred_total} appdetails requests, "
+                     f"~{deferred_total / details_rate / 3600:.1f}h of request budget at {details_rate:g} req/s.")
+    return '\n'.join(lines)
@@ -0,0 +1,306 @@
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from crawl_state import classify_result, record_price_checks, record_results
+from review_stats import reset_review_stats
+
+DB_PATH = 'steam_games.db'
+COMMIT_ROWS = 5000  # Commit once this many rows (details + reviews) are pending
+COMMIT_INTERVAL = 10  # ...or once this many seconds have passed since the last commit
+QUEUE_SIZE = 10000  # Results buffered between the fetchers and the writer
+BUSY_TIMEOUT = 30  # seconds a connection waits for another process's write lock (EDA, review_stats) before failing
+COMMIT_RETRIES = 5  # a batch whose commit still fails is retried this often, backing off exponentially
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+def connect(db_path=DB_PATH, check_same_thread=True, timeout=BUSY_TIMEOUT):
+    conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=check_same_thread)
+    # WAL lets readers (EDA, the app) run while the crawler writes
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def create_review_key(cursor):
+    # Steam's recommendation id is the natural key of a review; re-fetched reviews are ignored
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(game_reviews)')}
+    if 'recommendationid' not in columns:
+        cursor.execute('ALTER TABLE game_reviews ADD COLUMN recommendationid INTEGER')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_game_reviews_recommendationid ON game_reviews (recommendationid)')
+    # Reviews stored before the key existed have none, so they are found per app and replaced once the app is re-fetched
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_reviews_legacy ON game_reviews (appid) WHERE recommendationid IS NULL')
+
+def create_catalogue_columns(cursor):
+    # Typed copies of price and release date plus one row per genre, so catalogue filters are index lookups
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(game_details)')}
+    for column, column_type in (('price_cents', 'INTEGER'), ('currency', 'TEXT'), ('release_epoch', 'INTEGER')):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE game_details ADD COLUMN {column} {column_type}')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_details_price_cents ON game_details (price_cents)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_details_release_epoch ON game_details (release_epoch)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS game_genres (
+            appid INTEGER NOT NULL,
+            genre TEXT NOT NULL,
+            PRIMARY KEY (appid, genre)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_genres_genre ON game_genres (genre, appid)')
+
+RELEASE_DATE_FORMATS = ('%d %b, %Y', '%b %d, %Y', '%d %B, %Y', '%B %d, %Y', '%b %Y', '%B %Y', '%Y')
+
+def parse_release_epoch(release_date):
+    # Steam's display date ("21 Mar, 2024", "Mar 21, 2024", "2024") as a UTC epoch; None for "Coming soon" etc.
+    for date_format in RELEASE_DATE_FORMATS:
+        try:
+            return int(datetime.strptime(str(release_date).strip(), date_format).replace(tzinfo=timezone.utc).timestamp())
+        except ValueError:
+            continue
+    return None
+
+def parse_price_cents(price):
+    # Best effort for rows stored before price_cents existed: "$9.99" -> 999, "1.234,56€" -> 123456, "¥ 1,980" -> 198000
+    digits = re.sub(r'[^\d.,]', '', str(price or '')).strip('.,')
+    if not re.search(r'\d', digits):
+        return None
+    decimal = re.search(r'[.,](\d{2})$', digits)
+    whole = re.sub(r'\D', '', digits[:decimal.start()] if decimal else digits)
+    return int(whole or 0) * 100 + (int(decimal.group(1)) if decimal else 0)
+
+# Steam's currency prefixes and suffixes, most specific first; a bare "$" is the US store
+CURRENCY_SYMBOLS = (
+    ('CDN$', 'CAD'), ('A$', 'AUD'), ('NZ$', 'NZD'), ('R$', 'BRL'), ('Mex$', 'MXN'), ('HK$', 'HKD'), ('S$', 'SGD'),
+    ('NT$', 'TWD'), ('CLP$', 'CLP'), ('COL$', 'COP'), ('$', 'USD'), ('€', 'EUR'), ('£', 'GBP'), ('¥', 'JPY'),
+    ('₩', 'KRW'), ('₹', 'INR'), ('₺', 'TRY'), ('₴', 'UAH'), ('руб', 'RUB'), ('zł', 'PLN'), ('CHF', 'CHF'),
+)
+
+def parse_currency(price):
+    # Best effort counterpart of parse_price_cents: "$9.99" -> "USD", "1.234,56€" -> "EUR", "Free" -> None
+    if parse_price_cents(price) is None:
+        return None
+    return next((code for symbol, code in CURRENCY_SYMBOLS if symbol in str(price)), None)
+
+def genre_rows(game_details):
+    # tags holds the genre names joined with ', '
+    return [(row[0], genre) for row in game_details for genre in (row[7] or '').split(', ') if genre]
+
+def backfill_catalogue_columns(conn, chunk_size=5000):
+    """Fills the typed columns and game_genres for rows stored before they existed."""
+    rows = conn.execute('''
+        SELECT appid, price, release_date, tags FROM game_details
+        WHERE price_cents IS NULL AND release_epoch IS NULL
+    ''').fetchall()
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        conn.executemany('UPDATE game_details SET price_cents = ?, currency = COALESCE(currency, ?), release_epoch = ? WHERE appid = ?',
+                         [(parse_price_cents(price), parse_currency(price), parse_release_epoch(release_date), appid)
+                          for appid, price, release_date, _ in chunk])
+        conn.executemany('INSERT OR IGNORE INTO game_genres (appid, genre) VALUES (?, ?)',
+                         [(appid, genre) for appid, _, _, tags in chunk for genre in (tags or '').split(', ') if genre])
+        conn.commit()
+    return len(rows)
+
+DETAIL_COLUMNS = ('name', 'description', 'release_date', 'developer', 'publisher', 'tags')
+
+def create_change_log(cursor):
+    # Every insert or actual change of a game_details row is logged, so later stages
+    # (embeddings, indexes) can recompute only the apps that changed
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_changes (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            appid INTEGER NOT NULL,
+            changed_at INTEGER NOT NULL,
+            change TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_app_changes_changed_at ON app_changes (changed_at)')
+    details_changed = ' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in DETAIL_COLUMNS)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_game_details_insert AFTER INSERT ON game_details
+        BEGIN
+            INSERT INTO app_changes (appid, changed_at, change) VALUES (NEW.appid, CAST(strftime('%s', 'now') AS INTEGER), 'new');
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_game_details_update AFTER UPDATE ON game_details
+        WHEN {details_changed} OR OLD.price IS NOT NEW.price
+        BEGIN
+            INSERT INTO app_changes (appid, changed_at, change)
+            VALUES (NEW.appid, CAST(strftime('%s', 'now') AS INTEGER), CASE WHEN {details_changed} THEN 'details' ELSE 'price' END);
+        END
+    ''')
+
+def changed_appids(conn, since, changes=('new', 'details', 'price')):
+    placeholders = ', '.join('?' * len(changes))
+    return [row[0] for row in conn.execute(
+        f'SELECT DISTINCT appid FROM app_changes WHERE changed_at >= ? AND change IN ({placeholders})', (since, *changes))]
+
+def insert_batch(cursor, game_details, game_reviews):
+    # Re-fetched apps are upserted; the WHERE clause keeps unchanged rows (and the change log) untouched
+    cursor.executemany('''
+        INSERT INTO game_details (appid, name, description, price, release_date, developer, publisher, tags,
+                                  price_cents, currency, release_epoch)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(appid) DO UPDATE SET
+            name = excluded.name, description = excluded.description, price = excluded.price,
+            release_date = excluded.release_date, developer = excluded.developer,
+            publisher = excluded.publisher, tags = excluded.tags, price_cents = excluded.price_cents,
+            currency = excluded.currency, release_epoch = excluded.release_epoch
+        WHERE (game_details.name, game_details.description, game_details.price, game_details.release_date,
+               game_details.developer, game_details.publisher, game_details.tags,
+               game_details.price_cents, game_details.currency, game_details.release_epoch)
+           IS NOT (excluded.name, excluded.description, excluded.price, excluded.release_date,
+                   excluded.developer, excluded.publisher, excluded.tags,
+                   excluded.price_cents, excluded.currency, excluded.release_epoch)
+    ''', game_details)
+    # An app's genre rows are replaced wholesale
+    cursor.executemany('DELETE FROM game_genres WHERE appid = ?', [(row[0],) for row in game_details])
+    cursor.executemany('INSERT OR IGNORE INTO game_genres (appid, genre) VALUES (?, ?)', genre_rows(game_details))
+    # Keyless reviews of a re-fetched app would duplicate its new ones; deleted rows cannot be subtracted
+    # from review_stats, so the aggregates are reset and recomputed on their next update
+    cursor.executemany('DELETE FROM game_reviews INDEXED BY idx_game_reviews_legacy WHERE appid = ? AND recommendationid IS NULL',
+                       [(appid,) for appid in {review[0] for review in game_reviews}])
+    if cursor.rowcount > 0:
+        reset_review_stats(cursor)
+    # All reviews of the batch go in with a single executemany
+    cursor.executemany('''
+        INSERT OR IGNORE INTO game_reviews (appid, review_text, voted_up, timestamp_created, author_playtime_forever, author_playtime_last_two_weeks, author_num_reviews, recommendationid)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', game_reviews)
+
+def update_prices(cursor, prices):
+    # (appid, price, price_cents, currency) tuples from a price-only refresh; a None price
+    # means the answer carried no price, and the stored one is kept
+    cursor.executemany('''
+        UPDATE game_details SET price = ?, price_cents = ?, currency = ?
+        WHERE appid = ? AND (price, price_cents, currency) IS NOT (?, ?, ?)
+    ''', [(price, cents, currency, appid, price, cents, currency) for appid, price, cents, currency in prices if price is not None])
+    record_price_checks(cursor, [appid for appid, _, _, _ in prices])
+
+def stored_review_ids(conn, recommendation_ids):
+    if not recommendation_ids:
+        return set()
+    placeholders = ', '.join('?' * len(recommendation_ids))
+    return {row[0] for row in conn.execute(
+        f'SELECT recommendationid FROM game_reviews WHERE recommendationid IN ({placeholders})', list(recommendation_ids))}
+
+
+class DBWriter(threading.Thread):
+    """Owns the only SQLite connection of a crawl and writes queued results.
+
+    Fetch workers call ``submit`` and move on; rows are inserted and committed
+    on this thread once ``commit_rows`` are pending or ``commit_interval``
+    seconds have passed. Review pages are submitted as they are fetched; an
+    app's details and crawl_state row are submitted once it is finished and
+    land in the same transaction as its last reviews, so that commit is the
+    only checkpoint of the crawl.
+    """
+
+    def __init__(self, db_path=DB_PATH, commit_rows=COMMIT_ROWS, commit_interval=COMMIT_INTERVAL,
+                 queue_size=QUEUE_SIZE):
+        super().__init__(name='db-writer', daemon=True)
+        self.db_path = db_path
+        self.commit_rows = commit_rows
+        self.commit_interval = commit_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.rows_written = 0
+        self.commits = 0
+        self.error = None
+
+    def submit(self, appid, game_data, http_status):
+        # Failed fetches are submitted too (game_data None) so their state is recorded
+        self.queue.put(('app', appid, game_data, http_status))
+
+    def submit_reviews(self, reviews):
+        self.queue.put(('reviews', reviews))
+
+    def submit_prices(self, prices):
+        # (appid, price, price_cents, currency) tuples from a price-only refresh
+        self.queue.put(('prices', prices))
+
+    def close(self):
+        self.queue.put(_STOP)
+        self.join()
+        if self.error:
+            raise self.error
+
+    def run(self):
+        conn = connect(self.db_path)
+        game_details = []
+        game_reviews = []
+        states = []
+        prices = []
+        pending_rows = 0
+        start = last_commit = time.monotonic()
+        item = None
+        try:
+            while True:
+                timeout = max(0.0, last_commit + self.commit_interval - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if item is not None and item is not _STOP:
+                    if item[0] == 'reviews':
+                        game_reviews.extend(item[1])
+                        pending_rows += len(item[1])
+                    elif item[0] == 'prices':
+                        prices.extend(item[1])
+                        pending_rows += len(item[1])
+                    else:
+                        _, appid, game_data, http_status = item
+                        if game_data:
+                            game_details.append(game_data)
+                        status, reason = classify_result(game_data, http_status)
+                        states.append((appid, status, http_status, reason))
+                        pending_rows += 2 if game_data else 1
+
+                due = pending_rows >= self.commit_rows or time.monotonic() - last_commit >= self.commit_interval
+                if pending_rows and (due or item is _STOP):
+                    self._commit(conn, game_details, game_reviews, states, prices, pending_rows, start)
+                    game_details, game_reviews, states, prices, pending_rows = [], [], [], [], 0
+                if due or not pending_rows:
+                    last_commit = time.monotonic()
+                if item is _STOP:
+                    break
+        except Exception as e:
+            logger.error(f"Writer stopped after {self.rows_written} rows: {e}")
+            self.error = e
+            # Keep draining so producers blocked on a full queue are released
+            while item is not _STOP:
+                item = self.queue.get()
+        finally:
+            conn.close()
+
+    def _commit(self, conn, game_details, game_reviews, states, prices, pending_rows, start):
+        commit_start = time.monotonic()
+        # This commit is the crawl's only checkpoint, so a locked database is waited out instead of dropping the batch
+        for attempt in range(COMMIT_RETRIES + 1):
+            try:
+                cursor = conn.cursor()
+                insert_batch(cursor, game_details, game_reviews)
+                record_results(cursor, states)
+                if prices:
+                    update_prices(cursor, prices)
+                conn.commit()
+                break
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                if attempt == COMMIT_RETRIES:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Error inserting batch data: {e}; retrying {pending_rows} rows in {delay}s")
+                time.sleep(delay)
+        now = time.monotonic()
+        self.rows_written += pending_rows
+        self.commits += 1
+        logger.info(
+            f"Committed batch {self.commits}: {len(states)} apps ({len(game_details)} games, {len(game_reviews)} reviews), {pending_rows} rows "
+            f"in {now - commit_start:.2f}s ({self.rows_written / max(now - start, 1e-9):.0f} rows/s overall)"
+        )
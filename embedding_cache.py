@@ -0,0 +1,84 @@
+import hashlib
+import sqlite3
+
+import numpy as np
+
+CACHE_PATH = 'embedding_cache.db'
+LOOKUP_CHUNK = 500  # hashes per SELECT ... IN (...)
+
+
+def text_hash(text):
+    return hashlib.sha1(('' if text is None else str(text)).encode('utf-8')).digest()
+
+
+class EmbeddingCache:
+    """Persistent text embeddings keyed by (model name, max_length, sha1 of the text).
+
+    A description that has not changed since the last build is never sent
+    through the model again; edited or new descriptions hash differently and
+    miss.
+    """
+
+    def __init__(self, path=CACHE_PATH, model_name=None, max_length=None):
+        self.path = path
+        self.model_name = model_name
+        self.max_length = max_length
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model_name TEXT NOT NULL,
+                max_length INTEGER NOT NULL,
+                text_hash BLOB NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model_name, max_length, text_hash)
+            ) WITHOUT ROWID
+        ''')
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_engine(cls, engine, path=CACHE_PATH):
+        return cls(path, engine.cache_name, engine.max_length)
+
+    def get_many(self, hashes):
+        found = {}
+        hashes = list(set(hashes))
+        for start in range(0, len(hashes), LOOKUP_CHUNK):
+            chunk = hashes[start:start + LOOKUP_CHUNK]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = self.conn.execute(f'''
+                SELECT text_hash, vector FROM embeddings
+                WHERE model_name = ? AND max_length = ? AND text_hash IN ({placeholders})
+            ''', (self.model_name, self.max_length, *chunk))
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, items):
+        self.conn.executemany('''
+            INSERT OR REPLACE INTO embeddings (model_name, max_length, text_hash, vector) VALUES (?, ?, ?, ?)
+        ''', [(self.model_name, self.max_length, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def cached_encode(engine, cache, texts):
+    # Encodes only the texts missing from the cache and returns rows in input order
+    hashes = [text_hash(text) for text in texts]
+    found = cache.get_many(hashes)
+    missing = {}
+    for key, text in zip(hashes, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    cache.hits += len(texts) - sum(1 for key in hashes if key in missing)
+    cache.misses += sum(1 for key in hashes if key in missing)
+    if missing:
+        vectors = engine.encode(list(missing.values()))
+        new_items = list(zip(missing.keys(), vectors))
+        cache.put_many(new_items)
+        found.update(new_items)
+    if not texts:
+        return np.empty((0, engine.dim), dtype=np.float32)
+    return np.stack([found[key] for key in hashes])
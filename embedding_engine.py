@@ -0,0 +1,308 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+MODEL_NAME = 'bert-base-uncased'
+MAX_LENGTH = 512
+BATCH_SIZE = 32  # descriptions per forward pass
+CHUNK_SIZE = 2048  # rows embedded and flushed to disk between checkpoints
+BACKENDS = ('fp32', 'int8', 'torchscript')
+TRACE_LENGTH = 128  # sequence length the TorchScript graph is traced at; inputs are padded or truncated to it
+
+
+class EmbeddingEngine:
+    """Batched, inference-only BERT sentence embeddings.
+
+    Texts are tokenized once, sorted by token length and grouped into batches
+    that are only padded to their own longest member. Each forward pass runs
+    under ``torch.inference_mode`` and is mean-pooled over real tokens only, so
+    a text gets the same vector whether it is encoded alone or in a batch.
+    torch and transformers are imported on first use.
+
+    ``backend`` selects the CPU-optimised variants of the model: ``int8``
+    applies dynamic quantization to every Linear layer, ``torchscript`` runs a
+    traced, frozen graph at a fixed length of ``TRACE_LENGTH`` tokens.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, max_length=MAX_LENGTH, batch_size=BATCH_SIZE, device=None, backend='fp32'):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown encoder backend {backend!r}; expected one of {BACKENDS}")
+        self.model_name = model_name
+        self.max_length = min(max_length, TRACE_LENGTH) if backend == 'torchscript' else max_length
+        self.batch_size = batch_size
+        self.device = device
+        self.backend = backend
+        self.tokenizer = None
+        self.model = None
+        self.hidden_size = None
+        self.last_stats = {}
+
+    @property
+    def cache_name(self):
+        # Embedding caches keep the vectors of each backend apart
+        return self.model_name if self.backend == 'fp32' else f'{self.model_name}:{self.backend}'
+
+    def load(self):
+        if self.model is None:
+            import torch
+            from transformers import BertModel, BertTokenizerFast
+
+            if self.backend == 'int8':
+                # Quantized kernels are CPU-only
+                self.device = 'cpu'
+            self.device = self.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+            self.tokenizer = BertTokenizerFast.from_pretrained(self.model_name)
+            model = BertModel.from_pretrained(self.model_name, torchscript=self.backend == 'torchscript')
+            model.eval()
+            self.hidden_size = model.config.hidden_size
+            model = model.to(self.device)
+            if self.backend == 'int8':
+                # Linear weights are stored as int8 and activations quantized on the fly
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            elif self.backend == 'torchscript':
+                example = self.tokenizer(['warm up'], padding='max_length', max_length=self.max_length, return_tensors='pt')
+                with torch.no_grad():
+                    traced = torch.jit.trace(model, (example['input_ids'].to(self.device), example['attention_mask'].to(self.device)))
+                model = torch.jit.freeze(traced)
+            self.model = model
+        return self
+
+    @property
+    def dim(self):
+        if self.hidden_size is not None:
+            return self.hidden_size
+        # Only the config is read, so callers that never encode do not pay for the weights
+        from transformers import BertConfig
+
+        return BertConfig.from_pretrained(self.model_name).hidden_size
+
+    def _forward(self, features):
+        features = {key: value.to(self.device) for key, value in features.items()}
+        if self.backend == 'torchscript':
+            hidden = self.model(features['input_ids'], features['attention_mask'])[0]
+        else:
+            hidden = self.model(**features).last_hidden_state
+        # Masked mean pooling: padding positions do not contribute
+        mask = features['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return pooled.float().cpu().numpy()
+
+    def encode(self, texts, verbose=False):
+        import torch
+
+        self.load()
+        texts = ['' if text is None else str(text) for text in texts]
+        if not texts:
+            return np.empty((0, self.hidden_size), dtype=np.float32)
+        start = time.perf_counter()
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length, return_attention_mask=False)
+        lengths = np.array([len(ids) for ids in encoded['input_ids']])
+        # Batching texts of similar length keeps padding (wasted compute) to a minimum
+        order = np.argsort(lengths, kind='stable')
+        embeddings = np.empty((len(texts), self.hidden_size), dtype=np.float32)
+
+        padded_tokens = 0
+        with torch.inference_mode():
+            for batch_number, batch_start in enumerate(range(0, len(texts), self.batch_size)):
+                rows = order[batch_start:batch_start + self.batch_size]
+                features = self.tokenizer.pad(
+                    {key: [encoded[key][row] for row in rows] for key in encoded.keys()},
+                    padding='max_length' if self.backend == 'torchscript' else True,
+                    max_length=self.max_length, return_tensors='pt')
+                padded_tokens += features['input_ids'].numel()
+                embeddings[rows] = self._forward(features)
+                if verbose and batch_number % 20 == 0:
+                    print(f"Processed {batch_start + len(rows)} of {len(texts)} descriptions...")
+
+        elapsed = time.perf_counter() - start
+        self.last_stats = {
+            'texts': len(texts),
+            'seconds': elapsed,
+            'texts_per_sec': len(texts) / max(elapsed, 1e-9),
+            'tokens': int(lengths.sum()),
+            'padding_ratio': 1 - lengths.sum() / max(padded_tokens, 1),
+        }
+        return embeddings
+
+    def format_stats(self):
+        stats = self.last_stats
+        if not stats:
+            return "No texts encoded yet."
+        return (f"Encoded {stats['texts']} texts in {stats['seconds']:.1f}s "
+                f"({stats['texts_per_sec']:.1f} descriptions/sec, {stats['padding_ratio']:.1%} padding)")
+
+
+def manifest_path(matrix_path):
+    return os.path.splitext(matrix_path)[0] + '.manifest.json'
+
+def appids_path(matrix_path):
+    # Row -> appid mapping stored next to the matrix
+    return os.path.splitext(matrix_path)[0] + '.appids.npy'
+
+def _appids_digest(appids):
+    return hashlib.sha1(np.ascontiguousarray(appids, dtype=np.int64).tobytes()).hexdigest()
+
+def _texts_digest(texts):
+    digest = hashlib.sha1()
+    for text in texts:
+        digest.update(str(text).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _write_manifest(path, manifest):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp_path, path)
+
+def _add_range(ranges, start, end):
+    ranges = sorted(ranges + [[start, end]])
+    merged = [ranges[0]]
+    for range_start, range_end in ranges[1:]:
+        if range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+def _is_done(ranges, start, end):
+    return any(range_start <= start and end <= range_end for range_start, range_end in ranges)
+
+def build_embedding_matrix(engine, texts, appids, matrix_path, chunk_size=CHUNK_SIZE, encode_chunk=None):
+    """Embeds ``texts`` chunk by chunk into a preallocated ``.npy`` on disk.
+
+    The manifest next to the matrix lists the row ranges already written, so a
+    killed build resumes at the first unfinished chunk. It is only reused when
+    the model, max_length, chunk size and row -> appid mapping are unchanged.
+    Each written chunk also records a digest of its texts, so chunks whose
+    descriptions were edited since are embedded again. Returns the finished
+    matrix as a read-only memmap.
+    """
+    appids = np.asarray(appids, dtype=np.int64)
+    rows = len(texts)
+    if rows != len(appids):
+        raise ValueError(f"{rows} texts but {len(appids)} appids")
+    encode_chunk = encode_chunk or engine.encode
+    dim = engine.dim
+    manifest_file = manifest_path(matrix_path)
+    expected = {
+        'model_name': engine.cache_name,
+        'max_length': engine.max_length,
+        'rows': rows,
+        'dim': dim,
+        'chunk_size': chunk_size,
+        'appids_sha1': _appids_digest(appids),
+    }
+
+    manifest = None
+    if os.path.exists(manifest_file) and os.path.exists(matrix_path):
+        with open(manifest_file) as file:
+            manifest = json.load(file)
+        if any(manifest.get(key) != value for key, value in expected.items()):
+            print("Existing embedding manifest does not match this build; starting over.")
+            manifest = None
+
+    if manifest is None:
+        matrix = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float32, shape=(rows, dim))
+        np.save(appids_path(matrix_path), appids)
+        manifest = dict(expected, done=[], text_sha1={}, complete=False)
+        _write_manifest(manifest_file, manifest)
+    else:
+        matrix = np.lib.format.open_memmap(matrix_path, mode='r+')
+        # Manifests written before text digests existed re-check every chunk
+        manifest.setdefault('text_sha1', {})
+        done_rows = sum(end - start for start, end in manifest['done'])
+        print(f"Resuming embedding build: {done_rows} of {rows} rows already done; chunks with edited texts are redone.")
+
+    start_time = time.perf_counter()
+    encoded_rows = 0
+    for start in range(0, rows, chunk_size):
+        end = min(start + chunk_size, rows)
+        digest = _texts_digest(texts[start:end])
+        if _is_done(manifest['done'], start, end) and manifest['text_sha1'].get(str(start)) == digest:
+            continue
+        matrix[start:end] = encode_chunk(texts[start:end])
+        matrix.flush()
+        # The manifest is only updated once the rows are on disk
+        manifest['done'] = _add_range(manifest['done'], start, end)
+        manifest['text_sha1'][str(start)] = digest
+        _write_manifest(manifest_file, manifest)
+        encoded_rows += end - start
+        elapsed = time.perf_counter() - start_time
+        print(f"Embedded rows {start}-{end} of {rows} ({encoded_rows / max(elapsed, 1e-9):.1f} descriptions/sec)")
+
+    manifest['complete'] = True
+    _write_manifest(manifest_file, manifest)
+    del matrix
+    return np.load(matrix_path, mmap_mode='r')
+
+def check_alignment(matrix_path, appids):
+    # True when the matrix rows were built for exactly these appids, in this order
+    path = appids_path(matrix_path)
+    if not os.path.exists(path):
+        return None
+    return np.array_equal(np.load(path), np.asarray(appids, dtype=np.int64))
+
+def parity_check(reference, candidate, texts, search=None, k=5):
+    """Compares a candidate backend with the reference encoder on the query path.
+
+    Reports the cosine similarity of the two embeddings of each text, the
+    overlap of the top-k results ``search`` returns for them, and the latency
+    of encoding one text at a time with each engine.
+    """
+    def timed_encode(engine):
+        vectors, latencies = [], []
+        for text in texts:
+            start = time.perf_counter()
+            vectors.append(engine.encode([text])[0])
+            latencies.append((time.perf_counter() - start) * 1000)
+        return np.array(vectors), np.array(latencies)
+
+    reference.load()
+    candidate.load()
+    reference_vectors, reference_ms = timed_encode(reference)
+    candidate_vectors, candidate_ms = timed_encode(candidate)
+    norms = np.linalg.norm(reference_vectors, axis=1) * np.linalg.norm(candidate_vectors, axis=1)
+    cosines = (reference_vectors * candidate_vectors).sum(axis=1) / np.maximum(norms, 1e-12)
+    result = {
+        'texts': len(texts),
+        'cosine_mean': float(cosines.mean()),
+        'cosine_min': float(cosines.min()),
+        'reference_p50_ms': float(np.percentile(reference_ms, 50)),
+        'reference_p99_ms': float(np.percentile(reference_ms, 99)),
+        'candidate_p50_ms': float(np.percentile(candidate_ms, 50)),
+        'candidate_p99_ms': float(np.percentile(candidate_ms, 99)),
+    }
+    if search is not None:
+        overlaps = [len(set(search(a[None, :])) & set(search(b[None, :]))) / k for a, b in zip(reference_vectors, candidate_vectors)]
+        result[f'top{k}_overlap'] = float(np.mean(overlaps))
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parity and latency of an optimised encoder backend against fp32 BERT.")
+    parser.add_argument('--backend', default='int8', choices=BACKENDS[1:])
+    parser.add_argument('--descriptions', type=int, default=200, help="catalogue descriptions used as queries, on top of the sample queries")
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--artifacts', default='artifacts', help="bundle whose index scores the top-k overlap")
+    args = parser.parse_args()
+
+    from artifacts import Bundle, catalogue_rows
+    from loadgen import QUERIES
+
+    bundle = Bundle(args.artifacts)
+    projection, index, catalogue = bundle.projection(), bundle.item_index(), bundle.catalogue()
+    rows = np.random.default_rng(0).choice(catalogue.num_rows, min(args.descriptions, catalogue.num_rows), replace=False)
+    texts = QUERIES + [game['description'] for game in catalogue_rows(catalogue, rows)]
+    # Both engines share the backend's effective max_length, so only the backend differs
+    candidate = EmbeddingEngine(backend=args.backend, device='cpu')
+    reference = EmbeddingEngine(max_length=candidate.max_length, device='cpu')
+    result = parity_check(reference, candidate, texts, lambda vector: index.search(projection.transform(vector), args.k)[0][0], args.k)
+    print(f"{args.backend} vs fp32 over {result['texts']} texts: cosine mean {result['cosine_mean']:.4f}, min {result['cosine_min']:.4f}, "
+          f"top-{args.k} overlap {result[f'top{args.k}_overlap']:.3f}")
+    print(f"Latency per query: fp32 p50 {result['reference_p50_ms']:.1f} ms / p99 {result['reference_p99_ms']:.1f} ms, "
+          f"{args.backend} p50 {result['candidate_p50_ms']:.1f} ms / p99 {result['candidate_p99_ms']:.1f} ms")
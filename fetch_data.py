@@ -1,20 +1,41 @@
+import argparse
+import itertools
 import requests
 import sqlite3
 import time
 import os
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from tqdm import tqdm
 import random
+import threading
+from rate_limiter import TokenBucket
+from functools import partial
+from db_writer import (DB_PATH, DBWriter, backfill_catalogue_columns, changed_appids, connect, create_catalogue_columns,
+                       create_change_log, create_review_key, parse_release_epoch, stored_review_ids)
+from crawl_state import (CRAWL_ORDERS, create_crawl_state_table, import_processed_ids, iter_pending_appids, ledger_report,
+                         prepare_pending, prepare_price_refresh)
+from review_stats import create_review_stats_tables, update_review_stats
 
 API_KEY = os.getenv('STEAM_API_KEY')
-BASE_URL = 'http://api.steampowered.com/ISteamApps/GetAppList/v2/'
-DETAILS_URL = 'https://store.steampowered.com/api/appdetails'
+# Both hosts can be overridden to point the crawler at mock_steam_server.py
+BASE_URL = os.getenv('STEAM_APP_LIST_URL', 'http://api.steampowered.com/ISteamApps/GetAppList/v2/')
+STORE_URL = os.getenv('STEAM_STORE_URL', 'https://store.steampowered.com')
+DETAILS_URL = f'{STORE_URL}/api/appdetails'
+REVIEWS_URL = f'{STORE_URL}/appreviews'
 MAX_RETRIES = 5
-RATE_LIMIT = 1  # requests per second
+DETAILS_RATE_LIMIT = float(os.getenv('STEAM_DETAILS_RATE', 1))  # requests per second to DETAILS_URL
+REVIEWS_RATE_LIMIT = float(os.getenv('STEAM_REVIEWS_RATE', 1))  # requests per second to REVIEWS_URL
+RATE_LIMIT_BACKOFF = 30  # seconds to back off after a 429, doubled on every retry
+REQUEST_TIMEOUT = 30  # seconds
+RATE_LIMIT_BURST = 3  # requests allowed back to back before the rate applies
 MAX_WORKERS = 3  # Number of concurrent threads
-BATCH_SIZE = 50  # Save progress in batches
-PROCESSED_IDS_FILE = 'processed_ids.txt'
+MAX_IN_FLIGHT = MAX_WORKERS * 4  # Apps submitted to the pool ahead of their results being handled
+REVIEWS_PER_PAGE = 100  # Steam's maximum num_per_page
+MAX_REVIEWS_PER_GAME = 1000  # Stop following the review cursor after this many reviews
+PRICE_BATCH_SIZE = 100  # appids per price-only appdetails request in --refresh mode
+PRICE_MAX_AGE_DAYS = 1  # --refresh re-checks prices older than this
+DETAILS_MAX_AGE_DAYS = 7  # --refresh re-crawls details (and new reviews) older than this
 
 def setup_logging():
     logging.basicConfig(
@@ -31,8 +52,22 @@ def setup_logging():
 
 logger = setup_logging()
 
+# Shared by all worker threads; each request takes a token before it is sent
+details_limiter = TokenBucket(DETAILS_RATE_LIMIT, burst=RATE_LIMIT_BURST)
+reviews_limiter = TokenBucket(REVIEWS_RATE_LIMIT, burst=RATE_LIMIT_BURST)
+
+# One keep-alive session per worker thread so connections to the store are reused
+_thread_local = threading.local()
+
+def get_session():
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _thread_local.session = session
+    return session
+
 def create_tables():
-    conn = sqlite3.connect('steam_games.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
 
     c.execute('''
@@ -44,7 +79,10 @@ def create_tables():
             release_date TEXT,
             developer TEXT,
             publisher TEXT,
-            tags TEXT
+            tags TEXT,
+            price_cents INTEGER,
+            currency TEXT,
+            release_epoch INTEGER
         )
     ''')
 
@@ -58,167 +96,294 @@ def create_tables():
             author_playtime_forever INTEGER,
             author_playtime_last_two_weeks INTEGER,
             author_num_reviews INTEGER,
+            recommendationid INTEGER,
             FOREIGN KEY(appid) REFERENCES game_details(appid)
         )
     ''')
 
+    create_review_key(c)
+    create_catalogue_columns(c)
+    create_change_log(c)
+    create_crawl_state_table(c)
+    create_review_stats_tables(c)
+
     conn.commit()
     conn.close()
 
 def fetch_app_list():
     logger.info("Fetching app list...")
-    response = requests.get(BASE_URL)
+    response = requests.get(BASE_URL, timeout=REQUEST_TIMEOUT)
     response.raise_for_status()
     app_list = response.json()['applist']['apps']
     logger.info(f"Fetched {len(app_list)} apps.")
     return app_list
 
-def fetch_app_details(appid):
+def parse_price(details):
+    # (display price, price in cents, currency); free games have no price_overview
+    overview = details.get('price_overview')
+    if overview:
+        return overview.get('final_formatted', 'N/A'), overview.get('final'), overview.get('currency')
+    return 'N/A', 0 if details.get('is_free') else None, None
+
+def parse_app_details(appid, data):
+    if data and str(appid) in data and data[str(appid)]['success']:
+        details = data[str(appid)]['data']
+        price, price_cents, currency = parse_price(details)
+        release_date = details.get('release_date', {}).get('date', 'N/A')
+        return (
+            appid,
+            details.get('name'),
+            details.get('short_description'),
+            price,
+            release_date,
+            details.get('developers', ['N/A'])[0],
+            details.get('publishers', ['N/A'])[0],
+            ', '.join([genre['description'] for genre in details.get('genres', [])]),
+            price_cents,
+            currency,
+            parse_release_epoch(release_date)
+        )
+    return None
+
+def parse_app_reviews(appid, data):
+    review_entries = []
+    for review in data['reviews']:
+        review_data = (
+            appid,
+            review['review'],
+            review['voted_up'],
+            review['timestamp_created'],
+            review['author']['playtime_forever'],
+            review['author']['playtime_last_two_weeks'],
+            review['author']['num_reviews'],
+            int(review['recommendationid'])
+        )
+        review_entries.append(review_data)
+    return review_entries
+
+def review_page_params(cursor):
+    # filter=recent orders reviews newest first and lets the cursor walk all of them
+    return {'json': 1, 'filter': 'recent', 'language': 'all', 'review_type': 'all', 'purchase_type': 'all',
+            'num_per_page': REVIEWS_PER_PAGE, 'cursor': cursor}
+
+def select_new_reviews(conn, reviews, fetched, max_reviews, incremental):
+    # Returns the reviews of a page to keep and whether paging should stop
+    done = False
+    if incremental and reviews:
+        known = stored_review_ids(conn, [review[-1] for review in reviews])
+        if known:
+            # Pages are newest first, so everything from the first stored review on is already in the DB
+            reviews = list(itertools.takewhile(lambda review: review[-1] not in known, reviews))
+            done = True
+    if fetched + len(reviews) >= max_reviews:
+        reviews = reviews[:max_reviews - fetched]
+        done = True
+    return reviews, done
+
+def request_app_details(params, label):
+    # GET DETAILS_URL through the shared limiter with retries; returns (json, http_status)
+    session = get_session()
+    http_status = None
     for attempt in range(MAX_RETRIES):
         try:
-            response = requests.get(DETAILS_URL, params={'appids': appid})
+            details_limiter.acquire()
+            response = session.get(DETAILS_URL, params=params, timeout=REQUEST_TIMEOUT)
+            http_status = response.status_code
             if response.status_code == 429:  # Too Many Requests
-                logger.warning(f"Rate limit exceeded for appid {appid}. Retrying after delay.")
-                sleep_time = 30 * (2 ** attempt) + random.uniform(0.5, 1.5)  # Exponential backoff with jitter
+                details_limiter.on_throttle()
+                logger.warning(f"Rate limit exceeded for {label}. Retrying after delay (rate now {details_limiter.rate:.2f}/s).")
+                sleep_time = RATE_LIMIT_BACKOFF * (2 ** attempt) + random.uniform(0.5, 1.5)  # Exponential backoff with jitter
                 time.sleep(sleep_time)
                 continue
             response.raise_for_status()
-            data = response.json()
-            if data and str(appid) in data and data[str(appid)]['success']:
-                details = data[str(appid)]['data']
-                game_data = (
-                    appid,
-                    details.get('name'),
-                    details.get('short_description'),
-                    details.get('price_overview', {}).get('final_formatted', 'N/A'),
-                    details.get('release_date', {}).get('date', 'N/A'),
-                    details.get('developers', ['N/A'])[0],
-                    details.get('publishers', ['N/A'])[0],
-                    ', '.join([genre['description'] for genre in details.get('genres', [])])
-                )
-                return game_data
-            else:
-                logger.warning(f"Failed to fetch game details for appid: {appid}")
-                return None
+            details_limiter.on_success()
+            return response.json(), http_status
         except requests.RequestException as e:
-            logger.warning(f"Attempt {attempt + 1} failed for appid {appid}: {str(e)}")
+            logger.warning(f"Attempt {attempt + 1} failed for {label}: {str(e)}")
             sleep_time = 2 ** attempt + random.uniform(0.5, 1.5)  # Exponential backoff with jitter
             time.sleep(sleep_time)
-    return None
+    return None, http_status
+
+def fetch_app_details(appid):
+    # Returns (game_data, http_status); game_data is None when the app could not be fetched
+    data, http_status = request_app_details({'appids': appid}, f"appid {appid}")
+    if data is None:
+        return None, http_status
+    game_data = parse_app_details(appid, data)
+    if game_data is None:
+        logger.warning(f"Failed to fetch game details for appid: {appid}")
+    return game_data, http_status
+
+def parse_app_prices(appids, data):
+    prices = []
+    for appid in appids:
+        entry = (data or {}).get(str(appid))
+        if entry and entry.get('success'):
+            # Every app without a price_overview (free, unreleased or unpriced) comes back with an empty
+            # list instead of a data object; its price is unknown here, so only the check is recorded
+            details = entry.get('data')
+            prices.append((appid, *parse_price(details)) if details else (appid, None, None, None))
+    return prices
 
-def fetch_app_reviews(appid, num_reviews=100):
+def fetch_app_prices(appids):
+    # appdetails only accepts several appids at once when filtered down to price_overview
+    data, _ = request_app_details({'appids': ','.join(map(str, appids)), 'filters': 'price_overview'},
+                                  f"price batch starting at appid {appids[0]}")
+    return parse_app_prices(appids, data)
+
+def fetch_app_reviews(appid, on_page, max_reviews=MAX_REVIEWS_PER_GAME, incremental=False):
+    # Follows the review cursor, handing each page to on_page as soon as it arrives.
+    # Returns the number of reviews handed over.
+    session = get_session()
+    cursor = '*'
+    fetched = 0
+    throttled = 0
+    # Only incremental paging looks up stored reviews; the writer owns writes
+    read_conn = sqlite3.connect(DB_PATH) if incremental else None
     try:
-        url = f"https://store.steampowered.com/appreviews/{appid}?json=1&num_per_page={num_reviews}"
-        response = requests.get(url)
-        data = response.json()
-        if 'reviews' in data:
-            reviews = data['reviews']
-            review_entries = []
-            for review in reviews:
-                review_data = (
-                    appid,
-                    review['review'],
-                    review['voted_up'],
-                    review['timestamp_created'],
-                    review['author']['playtime_forever'],
-                    review['author']['playtime_last_two_weeks'],
-                    review['author']['num_reviews']
-                )
-                review_entries.append(review_data)
-            return review_entries
-        else:
-            logger.warning(f"Failed to fetch reviews for appid: {appid}")
-            return []
+        while fetched < max_reviews:
+            reviews_limiter.acquire()
+            response = session.get(f"{REVIEWS_URL}/{appid}", params=review_page_params(cursor), timeout=REQUEST_TIMEOUT)
+            if response.status_code == 429:
+                reviews_limiter.on_throttle()
+                logger.warning(f"Rate limit exceeded fetching reviews for appid {appid} (rate now {reviews_limiter.rate:.2f}/s).")
+                throttled += 1
+                if throttled >= MAX_RETRIES:
+                    break
+                continue
+            reviews_limiter.on_success()
+            data = response.json()
+            if 'reviews' not in data:
+                logger.warning(f"Failed to fetch reviews for appid: {appid}")
+                break
+            reviews, done = select_new_reviews(read_conn, parse_app_reviews(appid, data), fetched, max_reviews, incremental)
+            if reviews:
+                on_page(reviews)
+                fetched += len(reviews)
+            next_cursor = data.get('cursor')
+            # Steam keeps returning the same cursor with an empty page once the reviews run out
+            if done or not data['reviews'] or not next_cursor or next_cursor == cursor:
+                break
+            cursor = next_cursor
     except Exception as e:
         logger.error(f"Error fetching reviews for appid: {appid} - {e}")
-        return []
-
-def save_batch_to_db(game_details, game_reviews):
-    conn = sqlite3.connect('steam_games.db')
-    c = conn.cursor()
-    try:
-        # Insert game details
-        c.executemany('''
-            INSERT OR IGNORE INTO game_details (appid, name, description, price, release_date, developer, publisher, tags)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', game_details)
-
-        # Insert game reviews
-        for review in game_reviews:
-            c.executemany('''
-                INSERT INTO game_reviews (appid, review_text, voted_up, timestamp_created, author_playtime_forever, author_playtime_last_two_weeks, author_num_reviews)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', review)
-        conn.commit()
-    except sqlite3.OperationalError as e:
-        logger.error(f"Error inserting batch data: {e}")
     finally:
-        conn.close()
-
-def load_processed_ids():
-    if os.path.exists(PROCESSED_IDS_FILE):
-        with open(PROCESSED_IDS_FILE, 'r') as file:
-            processed_ids = set(int(line.strip()) for line in file)
-        return processed_ids
-    return set()
-
-def save_processed_id(appid):
-    with open(PROCESSED_IDS_FILE, 'a') as file:
-        file.write(f"{appid}\n")
-
-def fetch_data(appid):
-    game_data = fetch_app_details(appid)
-    game_reviews = []
+        if read_conn is not None:
+            read_conn.close()
+    return fetched
+
+def fetch_data(appid, on_reviews, max_reviews=MAX_REVIEWS_PER_GAME, incremental=False):
+    game_data, http_status = fetch_app_details(appid)
     if game_data:
-        reviews = fetch_app_reviews(appid, num_reviews=100)
-        if reviews:
-            game_reviews = reviews
-    return game_data, game_reviews
+        fetch_app_reviews(appid, on_reviews, max_reviews=max_reviews, incremental=incremental)
+    return game_data, http_status
+
+def stream_results(executor, fn, items, max_in_flight=MAX_IN_FLIGHT):
+    # Keeps at most max_in_flight futures alive, submitting the next item as each one completes
+    items = iter(items)
+    in_flight = {executor.submit(fn, item): item for item in itertools.islice(items, max_in_flight)}
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            item = in_flight.pop(future)
+            for next_item in itertools.islice(items, 1):
+                in_flight[executor.submit(fn, next_item)] = next_item
+            yield item, future
+
+def iter_batches(items, size):
+    items = iter(items)
+    while batch := list(itertools.islice(items, size)):
+        yield batch
 
-def main():
+def refresh_prices(executor, writer, conn, total, max_in_flight=MAX_IN_FLIGHT):
+    batches = iter_batches(iter_pending_appids(conn, table='price_refresh'), PRICE_BATCH_SIZE)
+    with tqdm(total=total, desc='prices') as pbar:
+        for appids, future in stream_results(executor, fetch_app_prices, batches, max_in_flight):
+            try:
+                writer.submit_prices(future.result())
+            except Exception as e:
+                logger.warning(f"Failed to refresh prices starting at appid: {appids[0]} - {e}")
+            pbar.update(len(appids))
+
+def main(offset=0, order='listed', max_in_flight=MAX_IN_FLIGHT, max_reviews=MAX_REVIEWS_PER_GAME, incremental=False,
+         refresh=False, price_max_age_days=PRICE_MAX_AGE_DAYS, details_max_age_days=DETAILS_MAX_AGE_DAYS):
     setup_logging()
     create_tables()  # Ensure tables are created
-    processed_ids = load_processed_ids()
+    conn = connect()
+    import_processed_ids(conn)
+    run_started = int(time.time())
     app_list = fetch_app_list()
-    total_apps = len(app_list)
-
-    game_details_batch = []
-    game_reviews_batch = []
-    batch_counter = 0
-
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(fetch_data, app['appid']): app['appid'] for app in app_list if app['appid'] not in processed_ids}
-        with tqdm(total=len(futures)) as pbar:
-            for future in as_completed(futures):
-                appid = futures[future]
-                try:
-                    game_data, game_reviews = future.result()
-                    if game_data:
-                        game_details_batch.append(game_data)
-                        game_reviews_batch.append(game_reviews)
-                        save_processed_id(appid)
-
-                    if len(game_details_batch) >= BATCH_SIZE:
-                        save_batch_to_db(game_details_batch, game_reviews_batch)
-                        game_details_batch.clear()
-                        game_reviews_batch.clear()
-                        batch_counter += 1
-                        logger.info(f"Saved batch {batch_counter}")
-
-                    logger.info(f"Fetched details for appid: {appid}")
-                except Exception as e:
-                    logger.warning(f"Failed to fetch details for appid: {appid} - {e}")
-                # Update progress bar
-                pbar.update(1)
-                # Rate limiting
-                time.sleep(1 / RATE_LIMIT + random.uniform(0.5, 1.5))  # Randomized sleep to reduce contention
-
-        # Save any remaining entries
-        if game_details_batch:
-            save_batch_to_db(game_details_batch, game_reviews_batch)
-            logger.info(f"Saved final batch")
-
-    logger.info(f"Data collection complete.")
+    # A refresh crawls new appids, re-crawls stale ones and re-checks stale prices in bulk
+    details_max_age = details_max_age_days * 86400 if refresh else None
+    total_apps = prepare_pending(conn, app_list, offset, order, details_max_age=details_max_age)
+    total_prices = prepare_price_refresh(conn, price_max_age_days * 86400) if refresh else 0
+    incremental = incremental or refresh
+    del app_list
+    if refresh:
+        logger.info(f"Refresh: {total_apps} apps to crawl, {total_prices} prices to re-check.")
+
+    # Only the writer thread writes to SQLite; an app counts as crawled once its batch is committed
+    writer = DBWriter()
+    writer.start()
+    start = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            if total_prices:
+                refresh_prices(executor, writer, conn, total_prices, max_in_flight)
+            pending = iter_pending_appids(conn)
+            # Review pages go straight from the worker threads to the writer
+            fetch = partial(fetch_data, on_reviews=writer.submit_reviews, max_reviews=max_reviews, incremental=incremental)
+            with tqdm(total=total_apps) as pbar:
+                for appid, future in stream_results(executor, fetch, pending, max_in_flight):
+                    try:
+                        game_data, http_status = future.result()
+                        writer.submit(appid, game_data, http_status)
+                        logger.info(f"Fetched details for appid: {appid}")
+                    except Exception as e:
+                        writer.submit(appid, None, None)
+                        logger.warning(f"Failed to fetch details for appid: {appid} - {e}")
+                    # Update progress bar
+                    pbar.update(1)
+    finally:
+        # Commits whatever is still pending
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Data collection complete: {total_apps} apps in {elapsed:.1f}s ({total_apps / max(elapsed, 1e-9):.2f} apps/s).")
+    if refresh:
+        changed = changed_appids(conn, run_started)
+        logger.info(f"Refresh changed {len(changed)} apps; see app_changes for changed_at >= {run_started}.")
+    # Only the reviews stored by this run are aggregated
+    logger.info(f"Review stats updated for {update_review_stats(conn)} games.")
+    conn.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Crawl Steam app details and reviews into steam_games.db.")
+    parser.add_argument('--offset', type=int, default=0, help="skip this many distinct appids of the ordered app list")
+    parser.add_argument('--order', choices=CRAWL_ORDERS, default='listed', help="order in which appids are crawled")
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT, help="apps in progress at once")
+    parser.add_argument('--max-reviews', type=int, default=MAX_REVIEWS_PER_GAME, help="reviews fetched per game at most")
+    parser.add_argument('--incremental', action='store_true', help="stop paging a game's reviews at the first one already stored")
+    parser.add_argument('--refresh', action='store_true', help="crawl new appids and re-check stale ones instead of a full crawl")
+    parser.add_argument('--price-max-age-days', type=float, default=PRICE_MAX_AGE_DAYS, help="--refresh re-checks prices older than this")
+    parser.add_argument('--details-max-age-days', type=float, default=DETAILS_MAX_AGE_DAYS, help="--refresh re-crawls details older than this")
+    parser.add_argument('--ledger-report', action='store_true', help="print the failure ledger summary and exit")
+    parser.add_argument('--backfill-catalogue', action='store_true', help="fill price_cents, release_epoch and game_genres for rows stored before they existed, then exit")
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    if args.ledger_report:
+        create_tables()
+        with connect() as conn:
+            print(ledger_report(conn, details_rate=DETAILS_RATE_LIMIT))
+        raise SystemExit
+    if args.backfill_catalogue:
+        create_tables()
+        with connect() as conn:
+            logger.info(f"Backfilled typed catalogue columns for {backfill_catalogue_columns(conn)} games.")
+        raise SystemExit
+    main(offset=args.offset, order=args.order, max_in_flight=args.max_in_flight,
+         max_reviews=args.max_reviews, incremental=args.incremental, refresh=args.refresh,
+         price_max_age_days=args.price_max_age_days, details_max_age_days=args.details_max_age_days)
@@ -0,0 +1,171 @@
+import argparse
+import re
+import time
+
+import numpy as np
+
+from vector_index import score_rows, top_k
+
+TOKEN_PATTERN = r'(?u)\b\w\w+\b'  # sklearn's default, so build and query tokenise alike
+FIELDS = {'name': 2, 'description': 1, 'developer': 1, 'tags': 1}  # game_details column -> times its text is repeated
+MAX_DF = 0.5  # terms in more than this fraction of games ("game", "the") are not indexed
+BM25_K1 = 1.2
+BM25_B = 0.75
+CANDIDATES = 1000  # lexical matches re-scored with dense vectors per query
+DENSE_WEIGHT = 0.7  # fused score = weight * cosine + (1 - weight) * BM25 / best BM25
+
+
+def tokenize(text):
+    return re.findall(TOKEN_PATTERN, str(text).lower())
+
+
+def game_documents(games_df):
+    # One text per game: the indexed columns, the name repeated so title matches count for more
+    documents = [games_df[field].fillna('').astype(str) for field, repeat in FIELDS.items() for _ in range(repeat)
+                 if field in games_df]
+    return [' '.join(parts) for parts in zip(*documents)]
+
+
+class LexicalIndex:
+    """BM25 inverted index over the game text columns.
+
+    Each term's postings are item rows with precomputed BM25 weights, stored
+    CSR-style, so a query only touches the postings of its own terms.
+    """
+
+    def __init__(self, terms, offsets, rows, weights):
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.terms)
+
+    @classmethod
+    def build(cls, games_df, max_df=MAX_DF, k1=BM25_K1, b=BM25_B):
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        documents = game_documents(games_df)
+        vectorizer = CountVectorizer(token_pattern=TOKEN_PATTERN, max_df=max_df, dtype=np.int32)
+        counts = vectorizer.fit_transform(documents)
+        # Document lengths count every token, including those pruned by max_df
+        lengths = np.array([len(tokenize(document)) for document in documents], dtype=np.float32)
+        postings = counts.tocsc()
+        postings.sort_indices()
+        df = np.diff(postings.indptr)
+        idf = np.log1p((len(lengths) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        tf = postings.data.astype(np.float32)
+        norm = k1 * (1 - b + b * lengths[postings.indices] / max(float(lengths.mean()), 1.0))
+        weights = np.repeat(idf, df) * tf * (k1 + 1) / (tf + norm)
+        return cls(list(vectorizer.get_feature_names_out()), postings.indptr.astype(np.int64),
+                   postings.indices.astype(np.int32), weights.astype(np.float32))
+
+    def save(self, prefix):
+        # Terms never contain a newline, so the vocabulary is stored as one newline-joined blob
+        np.save(f'{prefix}.terms.npy', np.frombuffer('\n'.join(self.terms).encode('utf-8'), dtype=np.uint8))
+        np.save(f'{prefix}.offsets.npy', self.offsets)
+        np.save(f'{prefix}.rows.npy', self.rows)
+        np.save(f'{prefix}.weights.npy', self.weights)
+
+    @classmethod
+    def load(cls, prefix, mmap_mode=None):
+        terms = np.load(f'{prefix}.terms.npy').tobytes().decode('utf-8')
+        return cls(terms.split('\n') if terms else [], np.load(f'{prefix}.offsets.npy', mmap_mode=mmap_mode),
+                   np.load(f'{prefix}.rows.npy', mmap_mode=mmap_mode), np.load(f'{prefix}.weights.npy', mmap_mode=mmap_mode))
+
+    def search(self, text, n=CANDIDATES, allowed=None):
+        """Top ``n`` item rows by BM25 for one query, best first, as (rows, scores).
+
+        Items matching no query term are not returned, so fewer than ``n`` rows
+        may come back. ``allowed`` is an optional boolean mask over the items.
+        """
+        terms = [self.term_ids[term] for term in set(tokenize(text)) if term in self.term_ids]
+        if not terms:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate([self.rows[self.offsets[term]:self.offsets[term + 1]] for term in terms])
+        weights = np.concatenate([self.weights[self.offsets[term]:self.offsets[term + 1]] for term in terms])
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights).astype(np.float32)
+        if allowed is not None:
+            keep = allowed[candidates]
+            candidates, scores = candidates[keep], scores[keep]
+        best, best_scores = top_k(scores[None, :], n)
+        return candidates[best[0]].astype(np.int64), best_scores[0]
+
+
+def hybrid_search(lexical, index, text, query, k=5, weight=DENSE_WEIGHT, candidates=CANDIDATES, allowed=None, min_matches=None):
+    """Top k items for one query: BM25 candidates re-scored with dense vectors and fused.
+
+    ``query`` is the query's (1, dim) embedding in the item space. Only the
+    lexical candidates are scored densely. When fewer than ``min_matches``
+    (default k) items match the query text, the dense ``index`` answers
+    instead. Returns (indices, scores) of shape (1, k) like ``index.search``,
+    -1 padded.
+    """
+    rows, lexical_scores = lexical.search(text, candidates, allowed)
+    if len(rows) < (k if min_matches is None else min_matches):
+        return index.search(query, k, allowed=allowed)
+    order = np.argsort(rows)
+    dense = np.empty(len(rows), dtype=np.float32)
+    dense[order] = score_rows(index.vectors, query, rows[order])[0]
+    return fuse(rows, lexical_scores, dense, k, weight)
+
+
+def fuse(rows, lexical_scores, dense, k=5, weight=DENSE_WEIGHT):
+    # Top k of one query's lexical candidates by fused score, given their cosines; (1, k), -1 padded
+    fused = weight * dense + (1 - weight) * lexical_scores / lexical_scores[0]
+    best, best_scores = top_k(fused[None, :], k)
+    indices = np.full((1, k), -1, dtype=np.int64)
+    scores = np.full((1, k), -np.inf, dtype=np.float32)
+    indices[:, :best.shape[1]] = rows[best]
+    scores[:, :best.shape[1]] = best_scores
+    return indices, scores
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latency and overlap of hybrid retrieval against dense-only search.")
+    parser.add_argument('--artifacts', default='artifacts', help="bundle with a lexical index, written by EDA.py")
+    parser.add_argument('--names', type=int, default=200, help="catalogue game names used as keyword queries, on top of the sample queries")
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--weight', type=float, default=DENSE_WEIGHT, help="dense weight in the fused score")
+    parser.add_argument('--candidates', type=int, default=CANDIDATES, help="lexical candidates re-scored per query")
+    args = parser.parse_args()
+
+    from artifacts import Bundle, catalogue_rows
+    from embedding_engine import EmbeddingEngine
+    from loadgen import QUERIES
+    from vector_index import ExactIndex
+
+    bundle = Bundle(args.artifacts)
+    lexical = bundle.lexical_index()
+    if lexical is None:
+        raise SystemExit(f"Bundle {bundle.version} has no lexical index; rebuild it with EDA.py")
+    projection, vectors, catalogue = bundle.projection(), bundle.item_vectors(), bundle.catalogue()
+    index, exact = bundle.item_index(vectors), ExactIndex(vectors)
+    rows = np.random.default_rng(0).choice(catalogue.num_rows, min(args.names, catalogue.num_rows), replace=False)
+    texts = QUERIES + [game['name'] for game in catalogue_rows(catalogue, rows)]
+    # Queries are embedded up front, so only retrieval is timed
+    embeddings = projection.transform(EmbeddingEngine().encode(texts))
+
+    methods = {
+        'dense exact': lambda text, query: exact.search(query, args.k),
+        'dense IVF': lambda text, query: index.search(query, args.k),
+        'hybrid': lambda text, query: hybrid_search(lexical, index, text, query, args.k, args.weight, args.candidates),
+    }
+    results, latencies = {}, {}
+    for name, method in methods.items():
+        results[name], latencies[name] = [], []
+        for text, query in zip(texts, embeddings):
+            start = time.perf_counter()
+            found, _ = method(text, query[None, :])
+            latencies[name].append((time.perf_counter() - start) * 1000)
+            results[name].append(found[0])
+    print(f"{len(lexical)} terms, {len(lexical.rows)} postings; {len(texts)} queries ({len(QUERIES)} descriptive, {len(rows)} game names)")
+    for name in methods:
+        overlap = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(results[name], results['dense exact'])])
+        # A name query should bring back the game it names
+        name_hits = np.mean([row in found for row, found in zip(rows, results[name][len(QUERIES):])])
+        print(f"{name:>11}: p50 {np.percentile(latencies[name], 50):.2f} ms, p99 {np.percentile(latencies[name], 99):.2f} ms, "
+              f"top-{args.k} overlap with dense exact {overlap:.3f}, named game found {name_hits:.1%}")
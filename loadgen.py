@@ -0,0 +1,79 @@
+import argparse
+import random
+import threading
+import time
+
+import numpy as np
+import requests
+
+# Drives concurrent load against recommend_service.py and reports throughput and latency:
+#   python recommend_service.py &
+#   python loadgen.py --url http://127.0.0.1:8000 --concurrency 32 --duration 30
+
+QUERIES = [
+    'open world rpg', 'co-op shooter', 'fast-paced multiplayer shooter', 'relaxing farming sim',
+    'roguelike deckbuilder', 'story rich detective game', 'space strategy with trading', 'survival crafting',
+    'history focused rpg', 'puzzle platformer', 'horror game with friends', 'city builder',
+    'racing game with car customization', 'turn based tactics', 'cozy puzzle game', 'vr rhythm game',
+]
+
+
+def run_client(url, top_k, queries, unique_rate, deadline, latencies, errors, lock, rng):
+    # One keep-alive session per simulated client
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        query = rng.choice(queries)
+        if rng.random() < unique_rate:
+            # Unseen text defeats the result cache, so these exercise the batched encoder
+            query = f'{query} {rng.randrange(10**9)}'
+        start = time.perf_counter()
+        try:
+            response = session.get(f'{url}/recommend', params={'q': query, 'top_k': top_k}, timeout=60)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors.append(elapsed)
+
+
+def run_load(url, concurrency=16, duration=10, top_k=5, unique_rate=0.5, seed=0):
+    latencies, errors, lock = [], [], threading.Lock()
+    deadline = time.monotonic() + duration
+    clients = [threading.Thread(target=run_client, args=(url, top_k, QUERIES, unique_rate, deadline, latencies, errors, lock, random.Random(seed + i)))
+               for i in range(concurrency)]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        'requests': len(latencies) + len(errors),
+        'errors': len(errors),
+        'throughput': (len(latencies) + len(errors)) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load generator for recommend_service.py.")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=16, help="simulated clients sending requests back to back")
+    parser.add_argument('--duration', type=float, default=10, help="seconds to run")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--unique-rate', type=float, default=0.5, help="fraction of queries made unique to miss the cache")
+    args = parser.parse_args()
+
+    result = run_load(args.url, args.concurrency, args.duration, args.top_k, args.unique_rate)
+    print(f"{result['requests']} requests ({result['errors']} errors) in {args.duration:.0f}s: {result['throughput']:.1f} req/s, "
+          f"p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms")
+    metrics = requests.get(f'{args.url}/metrics', timeout=10).json()
+    print(f"Service: {metrics['batches']} batches, mean batch size {metrics['mean_batch_size']:.1f}, "
+          f"result cache hit rate {metrics['cache']['results']['hit_rate']:.1%}")
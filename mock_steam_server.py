@@ -0,0 +1,182 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the app list, appdetails and appreviews endpoints.
+# Point the crawler at it with:
+#   STEAM_STORE_URL=http://127.0.0.1:8080 \
+#   STEAM_APP_LIST_URL=http://127.0.0.1:8080/ISteamApps/GetAppList/v2/ python async_crawler.py
+
+
+class FixedWindowLimiter:
+    # Steam answers 429 once a client exceeds its allowance for the window
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.window_start = time.monotonic()
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        if not self.limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.window:
+                self.window_start = now
+                self.count = 0
+            self.count += 1
+            return self.count <= self.limit
+
+
+class MockSteamState:
+    def __init__(self, num_apps, miss_rate, latency, details_limit, reviews_limit, window, seed, max_reviews=300, price_seed=0):
+        self.num_apps = num_apps
+        self.price_seed = price_seed
+        self.max_reviews = max_reviews
+        self.miss_rate = miss_rate
+        self.latency = latency
+        self.details_limiter = FixedWindowLimiter(details_limit, window)
+        self.reviews_limiter = FixedWindowLimiter(reviews_limit, window)
+        self.seed = seed
+        self.stats = {'connections': 0, 'requests': 0, 'throttled': 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def rng(self, appid):
+        return random.Random(self.seed * 1_000_003 + appid)
+
+    def app_list(self):
+        return {'applist': {'apps': [{'appid': 10 * (i + 1), 'name': f'Mock Game {i + 1}'} for i in range(self.num_apps)]}}
+
+    def app_details(self, appid, price_only=False):
+        rng = self.rng(appid)
+        if rng.random() < self.miss_rate:
+            return {str(appid): {'success': False}}
+        price = random.Random(self.price_seed * 1_000_003 + appid).choice([0, 499, 999, 1999, 5999])
+        if price_only:
+            # Like Steam, free games answer with an empty list when filtered to price_overview
+            overview = {'currency': 'USD', 'initial': price, 'final': price, 'final_formatted': f'${price / 100:.2f}'}
+            return {str(appid): {'success': True, 'data': {'price_overview': overview} if price else []}}
+        data = {
+            'name': f'Mock Game {appid // 10}',
+            'is_free': not price,
+            'short_description': f'A mock {rng.choice(["roguelike", "open world RPG", "co-op shooter", "puzzle"])} game number {appid}.',
+            'release_date': {'coming_soon': False, 'date': f'{rng.randint(1, 28)} Mar, {rng.randint(2005, 2024)}'},
+            'developers': [f'Studio {rng.randint(1, 50)}'],
+            'publishers': [f'Publisher {rng.randint(1, 20)}'],
+            'genres': [{'id': str(i), 'description': g} for i, g in enumerate(rng.sample(['Action', 'RPG', 'Indie', 'Strategy', 'Casual'], 2))],
+        }
+        if price:
+            data['price_overview'] = {'currency': 'USD', 'initial': price, 'final': price, 'final_formatted': f'${price / 100:.2f}'}
+        return {str(appid): {'success': True, 'data': data}}
+
+    def app_reviews(self, appid, num_per_page, cursor):
+        # Reviews are served newest first; the cursor is the offset of the next page
+        rng = self.rng(appid)
+        total = rng.randint(0, self.max_reviews)
+        start = 0 if cursor in (None, '*') else int(cursor)
+        reviews = [{
+            'recommendationid': str(appid * 100_000 + total - i),
+            'review': f'Review {total - i} of app {appid}',
+            'voted_up': rng.random() < 0.8,
+            'timestamp_created': 1_700_000_000 - i * 3600,
+            'author': {'playtime_forever': rng.randint(0, 5000), 'playtime_last_two_weeks': rng.randint(0, 100), 'num_reviews': rng.randint(1, 50)},
+        } for i in range(start, min(total, start + num_per_page))]
+        next_cursor = str(start + len(reviews)) if reviews else cursor
+        return {'success': 1, 'query_summary': {'num_reviews': len(reviews)}, 'reviews': reviews, 'cursor': next_cursor}
+
+
+def make_handler(state):
+    class MockSteamHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is observable
+
+        def setup(self):
+            super().setup()
+            state.count('connections')
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            state.count('requests')
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if state.latency:
+                time.sleep(state.latency)
+
+            if url.path.rstrip('/') == '/ISteamApps/GetAppList/v2':
+                return self.send_json(200, state.app_list())
+            if url.path == '/stats':
+                return self.send_json(200, state.stats)
+            if url.path == '/api/appdetails':
+                if not state.details_limiter.allow():
+                    state.count('throttled')
+                    return self.send_json(429, None)
+                appids = [int(appid) for appid in query['appids'][0].split(',')]
+                price_only = query.get('filters', [''])[0] == 'price_overview'
+                if len(appids) > 1 and not price_only:
+                    return self.send_json(400, None)
+                payload = {}
+                for appid in appids:
+                    payload.update(state.app_details(appid, price_only))
+                return self.send_json(200, payload)
+            match = re.fullmatch(r'/appreviews/(\d+)', url.path)
+            if match:
+                if not state.reviews_limiter.allow():
+                    state.count('throttled')
+                    return self.send_json(429, None)
+                num_per_page = int(query.get('num_per_page', ['20'])[0])
+                cursor = query.get('cursor', ['*'])[0]
+                return self.send_json(200, state.app_reviews(int(match.group(1)), num_per_page, cursor))
+            self.send_json(404, {'error': 'not found'})
+
+    return MockSteamHandler
+
+
+def serve(host='127.0.0.1', port=8080, num_apps=1000, miss_rate=0.3, latency=0.05,
+          details_limit=0, reviews_limit=0, window=300, seed=0, max_reviews=300, price_seed=0):
+    state = MockSteamState(num_apps, miss_rate, latency, details_limit, reviews_limit, window, seed, max_reviews, price_seed)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock Steam app list, appdetails and appreviews endpoints.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--num-apps', type=int, default=1000)
+    parser.add_argument('--miss-rate', type=float, default=0.3, help="fraction of apps answering success: false")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument('--details-limit', type=int, default=0, help="appdetails requests per window before 429 (0 = unlimited)")
+    parser.add_argument('--reviews-limit', type=int, default=0, help="appreviews requests per window before 429 (0 = unlimited)")
+    parser.add_argument('--window', type=float, default=300, help="rate limit window in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-reviews', type=int, default=300, help="upper bound of reviews per app")
+    parser.add_argument('--price-seed', type=int, default=0, help="change to simulate price updates between runs")
+    args = parser.parse_args()
+    server = serve(args.host, args.port, args.num_apps, args.miss_rate, args.latency,
+                   args.details_limit, args.reviews_limit, args.window, args.seed, args.max_reviews, args.price_seed)
+    print(f"Mock Steam API listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
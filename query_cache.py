@@ -0,0 +1,151 @@
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+EMBEDDING_CACHE_SIZE = 1024  # query embeddings kept in memory
+RESULT_CACHE_SIZE = 4096  # (query, k) result lists kept in memory
+
+
+def normalize_query(text):
+    # "Open-world  RPG!" and "open world rpg" share one cache entry
+    return ' '.join(re.sub(r'[^\w\s]', ' ', str(text).lower()).split())
+
+
+class LRUCache:
+    """Bounded, thread-safe mapping that evicts the least recently used key."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.data), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+class QueryCache:
+    """LRU caches in front of query embedding and top-k search.
+
+    Keys are normalised query text. Cached results belong to one item matrix
+    version and are dropped when it changes. With ``path`` set, results are also
+    written to a SQLite file so they survive restarts.
+    """
+
+    def __init__(self, version, path=None, embedding_size=EMBEDDING_CACHE_SIZE, result_size=RESULT_CACHE_SIZE):
+        self.version = version
+        self.embeddings = LRUCache(embedding_size)
+        self.results = LRUCache(result_size)
+        self.disk_hits = 0
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn_lock = threading.Lock()
+            with self.conn_lock:
+                self.conn.execute('''
+                    CREATE TABLE IF NOT EXISTS query_results (
+                        version TEXT NOT NULL,
+                        query TEXT NOT NULL,
+                        k INTEGER NOT NULL,
+                        indices BLOB NOT NULL,
+                        scores BLOB NOT NULL,
+                        PRIMARY KEY (version, query, k)
+                    ) WITHOUT ROWID
+                ''')
+                # Results computed against an older matrix are never valid again
+                self.conn.execute('DELETE FROM query_results WHERE version != ?', (version,))
+                self.conn.commit()
+
+    def set_version(self, version):
+        if version != self.version:
+            self.version = version
+            self.results.clear()
+            if self.conn is not None:
+                with self.conn_lock:
+                    self.conn.execute('DELETE FROM query_results WHERE version != ?', (version,))
+                    self.conn.commit()
+
+    def embedding(self, text, encode):
+        key = normalize_query(text)
+        vector = self.embeddings.get(key)
+        if vector is None:
+            vector = encode(key)
+            self.embeddings.put(key, vector)
+        return vector
+
+    def search(self, text, k, search, filters=()):
+        # search(text, k) -> (indices, scores) for one query; filters is a hashable tuple of
+        # (name, value) pairs the search applied, and becomes part of the key
+        key = (normalize_query(text) + ''.join(f' |{name}={value}' for name, value in filters), k)
+        result = self.results.get(key)
+        if result is None:
+            result = self._load(key)
+            if result is None:
+                result = search(text, k)
+                self._store(key, result)
+            self.results.put(key, result)
+        return result
+
+    def _load(self, key):
+        if self.conn is None:
+            return None
+        with self.conn_lock:
+            row = self.conn.execute(
+                'SELECT indices, scores FROM query_results WHERE version = ? AND query = ? AND k = ?',
+                (self.version, *key)).fetchone()
+        if row is None:
+            return None
+        self.disk_hits += 1
+        return np.frombuffer(row[0], dtype=np.int64), np.frombuffer(row[1], dtype=np.float32)
+
+    def _store(self, key, result):
+        if self.conn is None:
+            return
+        indices, scores = result
+        with self.conn_lock:
+            self.conn.execute('INSERT OR REPLACE INTO query_results VALUES (?, ?, ?, ?, ?)', (
+                self.version, *key,
+                np.asarray(indices, dtype=np.int64).tobytes(), np.asarray(scores, dtype=np.float32).tobytes()))
+            self.conn.commit()
+
+    def stats(self):
+        return {'version': self.version, 'embeddings': self.embeddings.stats(),
+                'results': dict(self.results.stats(), disk_hits=self.disk_hits)}
+
+    def format_stats(self):
+        embeddings, results = self.embeddings.stats(), self.results.stats()
+        return (f"query embeddings {embeddings['hit_rate']:.1%} hit rate ({embeddings['size']} cached), "
+                f"results {results['hit_rate']:.1%} hit rate ({results['size']} cached, {self.disk_hits} from disk)")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
@@ -0,0 +1,71 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket with AIMD rate adjustment.
+
+    Callers reserve a token before every request. When the bucket is empty the
+    reservation pushes the token count negative and returns how long the caller
+    has to wait, so concurrent workers are queued fairly instead of all waking
+    up at once. A throttled response (HTTP 429) halves the rate, and every
+    successful request adds a small step back until ``max_rate`` is reached.
+    """
+
+    def __init__(self, rate, burst=1, min_rate=None, increase=None, decrease_factor=0.5):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = float(min_rate) if min_rate else self.max_rate / 16
+        self.increase = float(increase) if increase else self.max_rate / 20
+        self.decrease_factor = decrease_factor
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        # Take a token and return the number of seconds to wait before using it
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        import asyncio
+
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttled += 1
+            # Requests already in flight will all see the same 429; only back off
+            # once per interval so a burst of them does not collapse the rate.
+            if now - self.last_decrease < max(1.0, 1 / self.rate):
+                return
+            self.last_decrease = now
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self.tokens = min(self.tokens, 0.0)
@@ -0,0 +1,253 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import serving
+from query_cache import normalize_query
+
+# Headless recommendation API over the current artifact bundle:
+#   GET  /recommend?q=open+world+rpg&top_k=5[&max_price_cents=999&currency=USD&released_after=1577836800&genre=RPG]
+#   POST /recommend  {"query": "open world rpg", "top_k": 5, "filters": {"genre": "RPG"}}
+#   GET  /genres
+#   GET  /similar?appid=570&top_k=5  (from the precomputed neighbour table, no model involved)
+#   GET  /health, GET /metrics
+# Run it with `python recommend_service.py` and point the app at it with RECOMMEND_SERVICE_URL.
+
+BATCH_WINDOW = 0.005  # seconds a batch waits for more queries after the first one arrives
+MAX_BATCH = 64  # queries encoded in one forward pass
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 100
+LATENCY_WINDOW = 10000  # most recent requests kept for the latency percentiles
+
+
+class MicroBatcher(threading.Thread):
+    """Groups concurrent queries into one BERT forward pass and one index search.
+
+    The first query of a batch opens a ``window``-second collection window;
+    whatever arrives within it (up to ``max_batch``) is encoded together and
+    scored against the items with a single matrix of queries.
+    """
+
+    def __init__(self, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        super().__init__(daemon=True)
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.batched_queries = 0
+
+    def search(self, text, k, filters=None):
+        # Same contract as serving.search: (row indices, scores) for one query
+        request = {'text': text, 'k': k, 'allowed': serving.filter_mask(filters), 'done': threading.Event()}
+        self.queue.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['result']
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self.run_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+            finally:
+                for request in batch:
+                    request['done'].set()
+
+    def run_batch(self, batch):
+        embeddings = serving.encode_queries([normalize_query(request['text']) for request in batch])
+        index = serving.get_item_index()
+        if serving.hybrid_enabled():
+            # Each query ranks its own lexical candidates; their union is scored with one matrix multiply
+            results = serving.rank_batch([request['text'] for request in batch], embeddings, [request['k'] for request in batch],
+                                         [request['allowed'] for request in batch])
+            for request, result in zip(batch, results):
+                request['result'] = result
+        unfiltered = [] if serving.hybrid_enabled() else [i for i, request in enumerate(batch) if request['allowed'] is None]
+        if unfiltered:
+            # A prefix of the top max(k) is the top k, so one search serves every k in the batch
+            indices, scores = index.search(embeddings[unfiltered], serving.candidate_count(max(batch[i]['k'] for i in unfiltered)))
+            for i, row_indices, row_scores in zip(unfiltered, indices, scores):
+                # Each request re-ranks exactly the candidates it would have fetched alone
+                n = serving.candidate_count(batch[i]['k'])
+                batch[i]['result'] = serving.rerank(row_indices[:n], row_scores[:n], batch[i]['k'])
+        # The rest each score their own candidate rows
+        for i, request in enumerate(batch):
+            if 'result' not in request:
+                request['result'] = serving.rank(request['text'], embeddings[i:i + 1], request['k'], request['allowed'])
+        self.batches += 1
+        self.batched_queries += len(batch)
+
+
+class ServiceMetrics:
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def record(self, seconds, ok=True):
+        with self.lock:
+            self.requests += 1
+            self.errors += not ok
+            self.latencies.append(seconds * 1000)
+
+    def snapshot(self, batcher):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            requests, errors = self.requests, self.errors
+        percentiles = {f'p{p}_ms': float(np.percentile(latencies, p)) if len(latencies) else 0.0 for p in (50, 95, 99)}
+        return {
+            'uptime_seconds': time.time() - self.started,
+            'requests': requests,
+            'errors': errors,
+            'latency': percentiles,
+            'batches': batcher.batches,
+            'mean_batch_size': batcher.batched_queries / batcher.batches if batcher.batches else 0.0,
+            'cache': serving.get_query_cache().stats(),
+            'load_timings': serving.load_timings,
+        }
+
+
+def make_handler(batcher, metrics):
+    class RecommendHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def recommend(self, text, top_k, filters=None):
+            try:
+                top_k = int(top_k if top_k is not None else DEFAULT_TOP_K)
+                if not isinstance(filters or {}, dict):
+                    raise TypeError('filters must be an object')
+                filters = {key: value for key, value in (filters or {}).items() if value not in (None, '')}
+                for key in ('max_price_cents', 'released_after'):
+                    if key in filters:
+                        filters[key] = int(filters[key])
+                for key in ('currency', 'genre'):
+                    if not isinstance(filters.get(key, ''), str):
+                        raise TypeError(f'{key} must be a string')
+                serving.clean_filters(filters)
+            except (TypeError, ValueError) as e:
+                return self.send_json(400, {'error': f'invalid top_k or filters: {e}'})
+            if not 1 <= top_k <= MAX_TOP_K:
+                return self.send_json(400, {'error': f'top_k must be between 1 and {MAX_TOP_K}'})
+            if not isinstance(text, str) or not text.strip():
+                return self.send_json(400, {'error': 'query is required'})
+            start = time.perf_counter()
+            try:
+                # Cache hits are answered directly; misses wait for the next micro-batch
+                results = serving.recommend(text, top_k, filters, search=lambda text, k, filters: serving.get_query_cache().search(
+                    text, k, lambda text, k: batcher.search(text, k, filters), serving.result_key(filters)))
+            except Exception as e:
+                metrics.record(time.perf_counter() - start, ok=False)
+                serving.logger.exception(f"Recommendation failed for {text!r}")
+                return self.send_json(500, {'error': str(e)})
+            metrics.record(time.perf_counter() - start)
+            self.send_json(200, {'query': text, 'top_k': top_k, 'filters': filters, 'version': serving.get_matrix_version(), 'results': results})
+
+        def similar(self, appid, top_k):
+            try:
+                appid = int(appid)
+                top_k = int(top_k if top_k is not None else DEFAULT_TOP_K)
+            except (TypeError, ValueError):
+                return self.send_json(400, {'error': 'appid and top_k must be integers'})
+            if not 1 <= top_k <= MAX_TOP_K:
+                return self.send_json(400, {'error': f'top_k must be between 1 and {MAX_TOP_K}'})
+            start = time.perf_counter()
+            try:
+                results = serving.recommend_by_appid(appid, top_k)
+            except KeyError as e:
+                return self.send_json(404, {'error': str(e.args[0])})
+            except LookupError as e:
+                return self.send_json(503, {'error': str(e)})
+            metrics.record(time.perf_counter() - start)
+            self.send_json(200, {'appid': appid, 'top_k': top_k, 'version': serving.get_matrix_version(), 'results': results})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == '/health':
+                return self.send_json(200, {'status': 'ok', 'version': serving.get_matrix_version(), 'items': len(serving.get_item_vectors())})
+            if url.path == '/metrics':
+                return self.send_json(200, metrics.snapshot(batcher))
+            if url.path == '/recommend':
+                filters = {key: query[key][0] for key in serving.FILTERS if key in query}
+                return self.recommend(query.get('q', [''])[0], query.get('top_k', [None])[0], filters)
+            if url.path == '/genres':
+                return self.send_json(200, {'genres': sorted(serving.get_genres())})
+            if url.path == '/similar':
+                return self.similar(query.get('appid', [None])[0], query.get('top_k', [None])[0])
+            self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/recommend':
+                return self.send_json(404, {'error': 'not found'})
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            except json.JSONDecodeError:
+                payload = None
+            if not isinstance(payload, dict):
+                return self.send_json(400, {'error': 'body must be a JSON object'})
+            self.recommend(payload.get('query', ''), payload.get('top_k'), payload.get('filters'))
+
+    return RecommendHandler
+
+
+def serve(host='127.0.0.1', port=8000, window=BATCH_WINDOW, max_batch=MAX_BATCH, warm=True):
+    if warm:
+        # Pay the model and bundle loads before the first request instead of during it
+        serving.get_item_index()
+        serving.get_catalogue()
+        serving.get_neighbours()
+        serving.get_appid_rows()
+        serving.get_lexical_index()
+        serving.get_item_priors()
+        serving.encode_queries(['warm up'])
+    batcher = MicroBatcher(window, max_batch)
+    batcher.start()
+    server = ThreadingHTTPServer((host, port), make_handler(batcher, ServiceMetrics()))
+    server.daemon_threads = True
+    server.batcher = batcher
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="HTTP/JSON game recommendation service with micro-batched query encoding.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--batch-window-ms', type=float, default=BATCH_WINDOW * 1000, help="how long a batch collects queries")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    args = parser.parse_args()
+    server = serve(args.host, args.port, args.batch_window_ms / 1000, args.max_batch)
+    serving.logger.info(f"Recommendation service listening on http://{args.host}:{args.port} (artifact version {serving.get_matrix_version()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,155 @@
+import argparse
+
+import numpy as np
+
+PCA_COMPONENTS = 256
+PROJECTION_PATH = 'pca_projection.npz'
+STORE_PREFIX = 'item_vectors'  # item_vectors.codes.npy (+ item_vectors.scales.npy for int8)
+STORE_DTYPE = 'int8'  # or 'float16'
+SCORE_BLOCK_ROWS = 16384  # rows dequantized at a time while scoring
+
+
+class Projection:
+    """A fitted PCA projection that can be applied to item and query embeddings alike."""
+
+    def __init__(self, mean, components, explained_variance_ratio=None):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.explained_variance_ratio = explained_variance_ratio
+
+    @property
+    def dim(self):
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, matrix, n_components=PCA_COMPONENTS):
+        from sklearn.decomposition import PCA
+
+        n_components = min(n_components, matrix.shape[0], matrix.shape[1])
+        pca = PCA(n_components=n_components)
+        pca.fit(matrix)
+        return cls(pca.mean_, pca.components_, pca.explained_variance_ratio_)
+
+    def transform(self, vectors):
+        return (np.atleast_2d(np.asarray(vectors, dtype=np.float32)) - self.mean) @ self.components.T
+
+    def save(self, path=PROJECTION_PATH):
+        np.savez(path, mean=self.mean, components=self.components,
+                 explained_variance_ratio=self.explained_variance_ratio if self.explained_variance_ratio is not None else [])
+
+    @classmethod
+    def load(cls, path=PROJECTION_PATH):
+        data = np.load(path)
+        return cls(data['mean'], data['components'], data['explained_variance_ratio'])
+
+
+class QuantizedMatrix:
+    """Row vectors stored as float16, or as int8 codes with one float32 scale per row.
+
+    Indexing returns another QuantizedMatrix over the selected rows; ``scores``
+    dequantizes block by block, so no full float32 copy is ever made.
+    """
+
+    def __init__(self, codes, scales=None):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def quantize(cls, vectors, dtype=STORE_DTYPE):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if dtype == 'float16':
+            return cls(vectors.astype(np.float16))
+        if dtype != 'int8':
+            raise ValueError(f"Unsupported store dtype: {dtype}")
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return cls(codes, scales.astype(np.float32))
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return QuantizedMatrix(self.codes[rows], self.scales[rows] if self.scales is not None else None)
+
+    def to_float32(self, start=0, stop=None):
+        block = self.codes[start:stop].astype(np.float32)
+        if self.scales is not None:
+            block *= self.scales[start:stop, None]
+        return block
+
+    def scores(self, queries):
+        # queries @ self.T, computed over blocks of rows
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        out = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), SCORE_BLOCK_ROWS):
+            stop = min(start + SCORE_BLOCK_ROWS, len(self))
+            block = self.codes[start:stop].astype(np.float32)
+            out[:, start:stop] = queries @ block.T
+            if self.scales is not None:
+                out[:, start:stop] *= self.scales[start:stop]
+        return out
+
+    def save(self, prefix=STORE_PREFIX):
+        np.save(f'{prefix}.codes.npy', self.codes)
+        if self.scales is not None:
+            np.save(f'{prefix}.scales.npy', self.scales)
+
+    @classmethod
+    def load(cls, prefix=STORE_PREFIX, mmap_mode=None):
+        codes = np.load(f'{prefix}.codes.npy', mmap_mode=mmap_mode)
+        scales = np.load(f'{prefix}.scales.npy', mmap_mode=mmap_mode) if codes.dtype == np.int8 else None
+        return cls(codes, scales)
+
+
+def recall_check(reference, candidate, k=5, n_queries=500, seed=0):
+    """Recall@k of item-to-item search on ``candidate`` against ``reference``.
+
+    Both are (n_items, dim) matrices or stores of the same items, possibly in
+    different spaces; the queries are catalogue items themselves.
+    """
+    from vector_index import ExactIndex
+
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(reference), min(n_queries, len(reference)), replace=False)
+    reference_index = ExactIndex(reference)
+    # Duck-typed: run as a script, this module's QuantizedMatrix is not the class artifacts.py loads
+    is_store = hasattr(candidate, 'to_float32')
+    candidate_index = ExactIndex(candidate, normalized=is_store)
+    reference_queries = np.asarray(reference[rows], dtype=np.float32)
+    candidate_queries = candidate[rows].to_float32() if is_store else candidate[rows]
+    truth, _ = reference_index.search(reference_queries, k + 1)
+    found, _ = candidate_index.search(candidate_queries, k + 1)
+    # Drop the query item itself from both result lists
+    recalls = [len(set(t[t != row][:k]) & set(f[f != row][:k])) / k for row, t, f in zip(rows, truth, found)]
+    return float(np.mean(recalls))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recall of the reduced, quantized item store against full-precision vectors.")
+    parser.add_argument('--matrix', default='bert_item_feature_matrix.npy', help="full-precision item embeddings")
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--artifacts', default='artifacts', help="directory of the artifact bundles written by EDA.py")
+    args = parser.parse_args()
+
+    from artifacts import Bundle
+    from vector_index import normalize
+
+    bundle = Bundle(args.artifacts)
+    full = np.load(args.matrix, mmap_mode='r')
+    projection = bundle.projection()
+    reduced = normalize(projection.transform(full))
+    store = bundle.item_vectors()
+    print(f"{full.shape[1]}-d float32 ({full.nbytes / 2**20:.1f} MiB) -> {reduced.shape[1]}-d {store.codes.dtype} ({store.nbytes / 2**20:.1f} MiB)")
+    print(f"recall@{args.k} reduced float32 vs full: {recall_check(full, reduced, args.k, args.queries):.3f}")
+    print(f"recall@{args.k} reduced {store.codes.dtype} vs reduced float32: {recall_check(reduced, store, args.k, args.queries):.3f}")
+    print(f"recall@{args.k} reduced {store.codes.dtype} vs full: {recall_check(full, store, args.k, args.queries):.3f}")
@@ -0,0 +1,190 @@
+import argparse
+import logging
+
+import numpy as np
+
+REVIEW_CHUNK_ROWS = 50000  # reviews per DataFrame yielded by iter_reviews
+PRIOR_Z = 1.96  # confidence of the Wilson lower bound used as the quality signal
+POPULARITY_SHARE = 0.5  # item prior = share * popularity + (1 - share) * quality
+STATS_COLUMNS = ('appid', 'review_count', 'positive_count', 'positive_ratio', 'median_playtime', 'first_review_at', 'last_review_at')
+
+logger = logging.getLogger(__name__)
+
+
+def create_review_stats_tables(cursor):
+    # Per-game aggregates of game_reviews, brought up to date from the review_id watermark on
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS review_stats (
+            appid INTEGER PRIMARY KEY,
+            review_count INTEGER NOT NULL,
+            positive_count INTEGER NOT NULL,
+            positive_ratio REAL NOT NULL,
+            median_playtime INTEGER,
+            first_review_at INTEGER,
+            last_review_at INTEGER
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_review_stats_review_count ON review_stats (review_count)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS review_stats_watermark (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            last_review_id INTEGER NOT NULL
+        )
+    ''')
+    # Covers per-game review lookups and the ordered playtime scan behind the median
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_reviews_appid ON game_reviews (appid, author_playtime_forever)')
+    # Lets one game's reviews be paged in review_id order without sorting them
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_reviews_appid_review_id ON game_reviews (appid, review_id)')
+
+
+def update_review_stats(conn):
+    """Folds reviews inserted since the last update into review_stats; returns the number of games touched.
+
+    Counts and first/last review times are aggregated with one GROUP BY over
+    the new rows only (review_id is AUTOINCREMENT, so new rows are exactly those
+    above the watermark). Medians cannot be merged, so they are recomputed for
+    the touched games from the (appid, playtime) index. A transaction left
+    open on ``conn`` is committed before the update starts.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    cursor = conn.cursor()
+    # Holds the write lock, so no review is inserted between reading the high mark and moving the watermark
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        row = cursor.execute('SELECT last_review_id FROM review_stats_watermark WHERE id = 0').fetchone()
+        low = row[0] if row else 0
+        high = cursor.execute('SELECT MAX(review_id) FROM game_reviews').fetchone()[0] or 0
+        if high <= low:
+            conn.commit()
+            return 0
+        cursor.execute('''
+            INSERT INTO review_stats (appid, review_count, positive_count, positive_ratio, first_review_at, last_review_at)
+            SELECT appid, COUNT(*), SUM(CASE WHEN voted_up THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN voted_up THEN 1 ELSE 0 END) * 1.0 / COUNT(*), MIN(timestamp_created), MAX(timestamp_created)
+            FROM game_reviews
+            WHERE review_id > ? AND review_id <= ?
+            GROUP BY appid
+            ON CONFLICT(appid) DO UPDATE SET
+                review_count = review_count + excluded.review_count,
+                positive_count = positive_count + excluded.positive_count,
+                positive_ratio = (positive_count + excluded.positive_count) * 1.0 / (review_count + excluded.review_count),
+                first_review_at = MIN(COALESCE(first_review_at, excluded.first_review_at), COALESCE(excluded.first_review_at, first_review_at)),
+                last_review_at = MAX(COALESCE(last_review_at, excluded.last_review_at), COALESCE(excluded.last_review_at, last_review_at))
+        ''', (low, high))
+        touched = cursor.rowcount
+        # Lower median of each touched game's playtimes
+        cursor.execute('''
+            WITH ranked AS (
+                SELECT appid, author_playtime_forever AS playtime,
+                       ROW_NUMBER() OVER (PARTITION BY appid ORDER BY author_playtime_forever) AS position,
+                       COUNT(*) OVER (PARTITION BY appid) AS reviews
+                FROM game_reviews
+                WHERE author_playtime_forever IS NOT NULL
+                  AND appid IN (SELECT appid FROM game_reviews WHERE review_id > ? AND review_id <= ?)
+            )
+            UPDATE review_stats SET median_playtime = ranked.playtime
+            FROM ranked
+            WHERE review_stats.appid = ranked.appid AND ranked.position = (ranked.reviews + 1) / 2
+        ''', (low, high))
+        cursor.execute('INSERT OR REPLACE INTO review_stats_watermark (id, last_review_id) VALUES (0, ?)', (high,))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return touched
+
+
+def reset_review_stats(cursor):
+    # Empties the aggregates in the caller's transaction; the next update recomputes every game
+    cursor.execute('DELETE FROM review_stats')
+    cursor.execute('DELETE FROM review_stats_watermark')
+
+
+def rebuild_review_stats(conn):
+    # Recomputes every game from scratch, e.g. after reviews were deleted
+    reset_review_stats(conn.cursor())
+    conn.commit()
+    return update_review_stats(conn)
+
+
+def load_review_stats(conn):
+    import pandas as pd
+
+    return pd.read_sql_query(f"SELECT {', '.join(STATS_COLUMNS)} FROM review_stats", conn)
+
+
+def iter_reviews(conn, columns=('appid', 'review_text'), appids=None, chunk_size=REVIEW_CHUNK_ROWS):
+    """Yields game_reviews as non-empty DataFrames of at most ``chunk_size`` rows.
+
+    Pages by review_id instead of OFFSET, so memory stays bounded by the chunk.
+    Without ``appids`` each chunk is one primary-key range scan in review_id
+    order; with them the games are read one after another, each in review_id
+    order from the (appid, review_id) index, so reviews of other games are
+    never read.
+    """
+    import pandas as pd
+
+    columns = ', '.join(dict.fromkeys(['review_id', *columns]))
+    if appids is None:
+        query = f"SELECT {columns} FROM game_reviews WHERE review_id > ? ORDER BY review_id LIMIT ?"
+        last = 0
+        while True:
+            chunk = pd.read_sql_query(query, conn, params=(last, chunk_size))
+            if chunk.empty:
+                return
+            last = int(chunk['review_id'].iloc[-1])
+            yield chunk
+    query = f"SELECT {columns} FROM game_reviews WHERE appid = ? AND review_id > ? ORDER BY review_id LIMIT ?"
+    # Small games are packed together until a chunk is full
+    parts, rows = [], 0
+    for appid in sorted({int(appid) for appid in appids}):
+        last = 0
+        while True:
+            limit = chunk_size - rows
+            part = pd.read_sql_query(query, conn, params=(appid, last, limit))
+            if not part.empty:
+                parts.append(part)
+                rows += len(part)
+                last = int(part['review_id'].iloc[-1])
+            if rows == chunk_size:
+                yield pd.concat(parts, ignore_index=True)
+                parts, rows = [], 0
+            if len(part) < limit:
+                break
+    if parts:
+        yield pd.concat(parts, ignore_index=True)
+
+
+def item_priors(review_count, positive_count, popularity_share=POPULARITY_SHARE, z=PRIOR_Z):
+    """Query-independent score in [0, 1] per game from its review counts.
+
+    Popularity is log review count relative to the most reviewed game. Quality
+    is the Wilson lower bound of the positive ratio, so a handful of positive
+    reviews does not outrank thousands. Games without reviews get 0.
+    """
+    n = np.asarray(review_count, dtype=np.float64)
+    positive = np.asarray(positive_count, dtype=np.float64)
+    reviewed = n > 0
+    safe_n = np.where(reviewed, n, 1)
+    ratio = positive / safe_n
+    quality = (ratio + z * z / (2 * safe_n) - z * np.sqrt(ratio * (1 - ratio) / safe_n + z * z / (4 * safe_n * safe_n))) / (1 + z * z / safe_n)
+    popularity = np.log1p(n) / np.log1p(n.max()) if len(n) and n.max() > 0 else np.zeros_like(n)
+    return np.where(reviewed, popularity_share * popularity + (1 - popularity_share) * quality, 0).astype(np.float32)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bring the review_stats table up to date with game_reviews.")
+    parser.add_argument('--rebuild', action='store_true', help="recompute every game instead of only new reviews")
+    args = parser.parse_args()
+
+    from db_writer import connect
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    conn = connect()
+    create_review_stats_tables(conn.cursor())
+    conn.commit()
+    touched = rebuild_review_stats(conn) if args.rebuild else update_review_stats(conn)
+    total = conn.execute('SELECT COUNT(*), COALESCE(SUM(review_count), 0) FROM review_stats').fetchone()
+    logger.info(f"Review stats updated for {touched} games; {total[0]} games, {total[1]} reviews aggregated.")
+    conn.close()
@@ -0,0 +1,301 @@
+import functools
+import logging
+import os
+import time
+
+import numpy as np
+
+from artifacts import ARTIFACTS_DIR, Bundle, catalogue_rows
+from embedding_engine import EmbeddingEngine
+from lexical_index import CANDIDATES, DENSE_WEIGHT, fuse, hybrid_search
+from query_cache import QueryCache
+from vector_index import score_rows
+
+ARTIFACTS_PATH = os.environ.get('ARTIFACTS_DIR', ARTIFACTS_DIR)  # bundles written by EDA.py
+ENCODER_BACKEND = os.environ.get('ENCODER_BACKEND', 'fp32')  # fp32, int8 or torchscript; see embedding_engine.py
+QUERY_CACHE_PATH = os.environ.get('QUERY_CACHE_PATH')  # e.g. query_cache.db; results stay in memory when unset
+RETRIEVAL = os.environ.get('RETRIEVAL', 'hybrid')  # hybrid (BM25 candidates re-scored densely) or dense
+HYBRID_DENSE_WEIGHT = float(os.environ.get('HYBRID_DENSE_WEIGHT', DENSE_WEIGHT))  # 1.0 ranks the candidates by cosine alone
+PRIOR_WEIGHT = float(os.environ.get('PRIOR_WEIGHT', 0.05))  # score += weight * review-based item prior; 0 ranks by relevance alone
+PRIOR_OVERFETCH = 4  # with priors, k * this many results are re-ranked to produce the top k
+
+
+def setup_logging():
+    logger = logging.getLogger('serving')
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+logger = setup_logging()
+
+# Seconds each resource took to load, filled in the first time it is requested
+load_timings = {}
+_runs = 0
+
+
+def resource(name):
+    # Loads once per process; later calls return the same object
+    def decorator(loader):
+        @functools.lru_cache(maxsize=None)
+        @functools.wraps(loader)
+        def wrapper():
+            start = time.perf_counter()
+            value = loader()
+            load_timings[name] = time.perf_counter() - start
+            logger.info(f"Loaded {name} in {load_timings[name]:.2f}s")
+            return value
+        return wrapper
+    return decorator
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoder():
+    # Configured but not loaded, so the encoder can be named without importing torch
+    return EmbeddingEngine(backend=ENCODER_BACKEND)
+
+@resource('embedding model')
+def get_engine():
+    # torch and transformers are first imported here
+    return get_encoder().load()
+
+def get_model():
+    return get_engine().model
+
+def get_tokenizer():
+    return get_engine().tokenizer
+
+@resource('artifact bundle')
+def get_bundle():
+    return Bundle(ARTIFACTS_PATH)
+
+@resource('PCA projection')
+def get_projection():
+    return get_bundle().projection()
+
+@resource('item vectors')
+def get_item_vectors():
+    return get_bundle().item_vectors()
+
+@resource('item index')
+def get_item_index():
+    return get_bundle().item_index(get_item_vectors())
+
+@resource('game catalogue')
+def get_catalogue():
+    return get_bundle().catalogue()
+
+def get_games(rows):
+    # Catalogue entries (dicts) for the given item rows
+    return catalogue_rows(get_catalogue(), rows)
+
+@resource('item neighbours')
+def get_neighbours():
+    return get_bundle().neighbours()
+
+@resource('appid lookup')
+def get_appid_rows():
+    return get_bundle().appid_rows()
+
+def row_for_appid(appid):
+    # O(1): the bundle stores a direct-address appid -> row table
+    table = get_appid_rows()
+    return int(table[appid]) if 0 <= appid < len(table) else -1
+
+@resource('lexical index')
+def get_lexical_index():
+    return get_bundle().lexical_index()
+
+@resource('item priors')
+def get_item_priors():
+    return get_bundle().item_priors()
+
+def prior_enabled():
+    return PRIOR_WEIGHT > 0 and get_item_priors() is not None
+
+def candidate_count(k):
+    # Results fetched per query so the prior can promote games from just below the top k
+    return k * PRIOR_OVERFETCH if prior_enabled() else k
+
+def rerank(indices, scores, k):
+    # Adds each game's popularity/quality prior (one array lookup per result) and keeps the best k
+    if prior_enabled():
+        priors = get_item_priors()
+        scores = np.where(indices >= 0, scores + PRIOR_WEIGHT * priors[np.maximum(indices, 0)], scores).astype(np.float32)
+        order = np.argsort(-scores, kind='stable')
+        indices, scores = indices[order], scores[order]
+    return indices[:k], scores[:k]
+
+def hybrid_enabled():
+    # Bundles built before the lexical index existed are searched densely
+    return RETRIEVAL == 'hybrid' and get_lexical_index() is not None
+
+def get_matrix_version():
+    # Cached results are only valid for the artifact version they were computed on
+    return get_bundle().version
+
+@resource('query cache')
+def get_query_cache():
+    return QueryCache(get_matrix_version(), QUERY_CACHE_PATH)
+
+
+def encode_queries(texts):
+    # One batched forward pass, projected into the item space
+    return get_projection().transform(get_engine().encode(texts))
+
+def embed_query(text):
+    return get_query_cache().embedding(text, lambda query: encode_queries([query]))
+
+@resource('genres')
+def get_genres():
+    return get_bundle().genres()
+
+@resource('price currency')
+def get_price_currency():
+    # The catalogue's most common currency, which max_price_cents is in unless a currency is given;
+    # None for bundles built before the currency was stored
+    catalogue = get_catalogue()
+    if 'currency' not in catalogue.column_names:
+        return None
+    counts = catalogue['currency'].drop_null().value_counts().to_pylist()
+    return max(counts, key=lambda count: count['counts'])['values'] if counts else None
+
+FILTERS = ('max_price_cents', 'currency', 'released_after', 'genre')
+
+def clean_filters(filters):
+    # Hashable, canonical form of a filter dict; unset filters are dropped
+    unknown = set(filters or {}) - set(FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+    return tuple(sorted((key, value) for key, value in (filters or {}).items() if value not in (None, '')))
+
+@functools.lru_cache(maxsize=256)
+def _filter_mask(filters):
+    import pyarrow.compute as pc
+
+    catalogue = get_catalogue()
+    mask = np.ones(catalogue.num_rows, dtype=bool)
+    settings = dict(filters)
+    if ('max_price_cents' in settings or 'currency' in settings) and 'currency' in catalogue.column_names:
+        # Prices are only comparable within one currency; free games have none and match any
+        currency = settings.get('currency') or get_price_currency()
+        same_currency = pc.or_kleene(pc.equal(catalogue['currency'], currency), pc.equal(catalogue['price_cents'], 0))
+        mask &= pc.fill_null(same_currency, False).to_numpy(zero_copy_only=False)
+    for key, value in filters:
+        if key == 'currency':
+            continue
+        if key == 'genre':
+            genre_mask = np.zeros(catalogue.num_rows, dtype=bool)
+            genre_mask[get_genres().get(value, [])] = True
+            mask &= genre_mask
+        else:
+            column, compare = ('price_cents', pc.less_equal) if key == 'max_price_cents' else ('release_epoch', pc.greater_equal)
+            # Rows whose price or date is unknown never match a range filter
+            mask &= pc.fill_null(compare(catalogue[column], int(value)), False).to_numpy(zero_copy_only=False)
+    return mask
+
+def filter_mask(filters):
+    """Boolean mask over the item rows that pass every catalogue filter, or None when nothing is filtered.
+
+    ``filters`` may set max_price_cents, currency, released_after (UTC epoch)
+    and genre. Only games priced in ``currency`` (default: the catalogue's most
+    common one) or free pass a price filter. Masks are computed from the
+    memory-mapped catalogue columns and cached.
+    """
+    filters = clean_filters(filters)
+    return _filter_mask(filters) if filters else None
+
+def result_key(filters):
+    # What a cached result depends on besides the query text and k; the persistent
+    # cache outlives the process, so the encoder backend is part of it too
+    encoder = (('encoder', get_encoder().cache_name),)
+    retrieval = (('retrieval', f'hybrid:{HYBRID_DENSE_WEIGHT}'),) if hybrid_enabled() else ()
+    prior = (('prior', PRIOR_WEIGHT),) if prior_enabled() else ()
+    return clean_filters(filters) + encoder + retrieval + prior
+
+def rank(text, embedding, k, allowed=None):
+    # (row indices, scores) of the top k items for one embedded query; -1 pads missing results
+    n = candidate_count(k)
+    if hybrid_enabled():
+        # n results feed the prior re-ranking, but the dense fallback is only for queries matching fewer than k games
+        indices, scores = hybrid_search(get_lexical_index(), get_item_index(), text, embedding, n, HYBRID_DENSE_WEIGHT,
+                                        allowed=allowed, min_matches=k)
+    else:
+        indices, scores = get_item_index().search(embedding, n, allowed=allowed)
+    return rerank(indices[0], scores[0], k)
+
+def rank_batch(texts, embeddings, ks, allowed):
+    """``rank`` for several embedded queries at once, one (row indices, scores) pair per query.
+
+    With hybrid retrieval every query keeps its own BM25 candidates, but the
+    union of them is scored densely with one matrix multiply. Queries matching
+    fewer than k games fall back to the dense index, as in ``rank``.
+    """
+    if not hybrid_enabled():
+        return [rank(text, embeddings[i:i + 1], k, mask) for i, (text, k, mask) in enumerate(zip(texts, ks, allowed))]
+    lexical, index = get_lexical_index(), get_item_index()
+    matches = [lexical.search(text, CANDIDATES, mask) for text, mask in zip(texts, allowed)]
+    hybrid = [i for i, (rows, _) in enumerate(matches) if len(rows) >= ks[i]]
+    results = [None] * len(texts)
+    if hybrid:
+        union = np.unique(np.concatenate([matches[i][0] for i in hybrid]))
+        dense = score_rows(index.vectors, embeddings[hybrid], union)
+        for query, i in enumerate(hybrid):
+            rows, lexical_scores = matches[i]
+            indices, scores = fuse(rows, lexical_scores, dense[query, np.searchsorted(union, rows)], candidate_count(ks[i]),
+                                   HYBRID_DENSE_WEIGHT)
+            results[i] = rerank(indices[0], scores[0], ks[i])
+    for i, result in enumerate(results):
+        if result is None:
+            indices, scores = index.search(embeddings[i:i + 1], candidate_count(ks[i]), allowed=allowed[i])
+            results[i] = rerank(indices[0], scores[0], ks[i])
+    return results
+
+def search(text, k=5, filters=None):
+    # (row indices, scores) of the top k items for one text query; -1 pads missing results
+    allowed = filter_mask(filters)
+    return get_query_cache().search(text, k, lambda query, k: rank(query, embed_query(query), k, allowed), result_key(filters))
+
+def recommend(text, k=5, filters=None, search=search):
+    """Top k games for a text query as catalogue dicts, each with its ``score``.
+
+    The score is the cosine, or with hybrid retrieval the cosine fused with the
+    query's BM25 score, plus the game's review-based prior when the bundle has
+    one. ``filters`` restricts scoring to the games matching
+    them, see ``filter_mask``.
+    """
+    indices, scores = search(text, k, filters)
+    keep = indices >= 0
+    games = get_games(indices[keep])
+    for game, score in zip(games, scores[keep]):
+        game['score'] = float(score)
+    return games
+
+def recommend_by_appid(appid, k=5):
+    """Games most like ``appid``, answered from the precomputed neighbour table without the model."""
+    row = row_for_appid(appid)
+    if row < 0:
+        raise KeyError(f"Unknown appid {appid}")
+    neighbours = get_neighbours()
+    if neighbours is None:
+        raise LookupError("The current artifact bundle has no neighbour table; rebuild it with EDA.py")
+    rows, scores = neighbours
+    games = get_games(rows[row, :k])
+    for game, score in zip(games, scores[row, :k]):
+        game['score'] = float(score)
+    return games
+
+
+def log_run(seconds):
+    """Logs one script run: the first in a process is the cold start, the rest are warm reruns."""
+    global _runs
+    _runs += 1
+    if _runs == 1:
+        loaded = ', '.join(f"{name} {elapsed:.2f}s" for name, elapsed in load_timings.items())
+        logger.info(f"Cold start in {seconds:.2f}s ({loaded or 'nothing loaded'})")
+    else:
+        cache_stats = f"; {get_query_cache().format_stats()}" if 'query cache' in load_timings else ''
+        logger.info(f"Warm rerun {_runs - 1} in {seconds * 1000:.1f} ms{cache_stats}")
@@ -1,4 +1,7 @@
 import sqlite3
+from crawl_state import create_crawl_state_table
+from db_writer import create_catalogue_columns, create_change_log, create_review_key
+from review_stats import create_review_stats_tables
 
 def create_tables():
     conn = sqlite3.connect('steam_games.db')
@@ -14,7 +17,10 @@ def create_tables():
             release_date TEXT,
             developer TEXT,
             publisher TEXT,
-            tags TEXT
+            tags TEXT,
+            price_cents INTEGER,
+            currency TEXT,
+            release_epoch INTEGER
         )
     ''')
 
@@ -29,10 +35,21 @@ def create_tables():
             author_playtime_forever INTEGER,
             author_playtime_last_two_weeks INTEGER,
             author_num_reviews INTEGER,
+            recommendationid INTEGER,
             FOREIGN KEY(appid) REFERENCES game_details(appid)
         )
     ''')
 
+    create_review_key(c)
+    create_catalogue_columns(c)
+    create_change_log(c)
+
+    # Create table for crawl progress
+    create_crawl_state_table(c)
+
+    # Per-game review aggregates used for ranking
+    create_review_stats_tables(c)
+
     conn.commit()
     conn.close()
 
@@ -1,8 +1,14 @@
+import time
+run_start = time.perf_counter()
+
+import os
+from datetime import datetime, timezone
+
+import requests
 import streamlit as st
-import numpy as np
-from transformers import BertTokenizer, BertModel
-from sklearn.metrics.pairwise import cosine_similarity
-import pandas as pd
+import serving
+
+RECOMMEND_SERVICE_URL = os.environ.get('RECOMMEND_SERVICE_URL')  # e.g. http://127.0.0.1:8000; recommend in-process when unset
 
 # Custom CSS for styling
 def local_css():
@@ -93,32 +99,34 @@ def local_css():
 # Apply the custom CSS
 local_css()
 
-# Load pre-trained BERT model and tokenizer
-bert_tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-bert_model = BertModel.from_pretrained('bert-base-uncased')
-
-@st.cache_data
-def load_data():
-    games_df = pd.read_csv('filtered_games_df.csv')
-    reduced_item_feature_matrix = np.load('reduced_item_feature_matrix.npy')
-    return games_df, reduced_item_feature_matrix
-
-# Function to get text embedding
+# Function to get text embedding; the BERT model is loaded once per process, on the first query
 def get_embedding(text):
-    inputs = bert_tokenizer(text, return_tensors='pt', truncation=True, padding=True, max_length=512)
-    outputs = bert_model(**inputs)
-    return outputs.last_hidden_state.mean(dim=1).cpu().detach().numpy()
+    return serving.embed_query(text)
+
+# Recommendation function; returns the recommended games, best first
+def recommend_games(user_input, top_n=5, filters=None):
+    if RECOMMEND_SERVICE_URL:
+        response = requests.get(f'{RECOMMEND_SERVICE_URL}/recommend', params={'q': user_input, 'top_k': top_n, **(filters or {})}, timeout=30)
+        response.raise_for_status()
+        return response.json()['results']
+    # Repeated and near-duplicate queries are answered from the query cache
+    return serving.recommend(user_input, top_n, filters)
 
-# Recommendation function
-def recommend_games(user_input, item_feature_matrix, games_df):
-    user_embedding = get_embedding(user_input)
-    similarities = cosine_similarity(user_embedding, reduced_item_feature_matrix)
-    top_n = 5
-    recommendations = similarities[0].argsort()[-top_n:][::-1]
-    return recommendations
+# Genre names for the filter; fetched once per process
+@st.cache_resource
+def get_genre_names():
+    if RECOMMEND_SERVICE_URL:
+        response = requests.get(f'{RECOMMEND_SERVICE_URL}/genres', timeout=30)
+        response.raise_for_status()
+        return response.json()['genres']
+    return sorted(serving.get_genres())
 
-# Load data
-games_df, reduced_item_feature_matrix = load_data()
+# Open the current artifact bundle, unless recommend_service.py serves it; cached per process,
+# so reruns after a widget interaction reuse it
+if not RECOMMEND_SERVICE_URL:
+    serving.get_catalogue()
+    serving.get_item_index()
+    serving.get_lexical_index()
 
 # Streamlit app
 st.markdown("<h1 class='title'>Steam Game Recommendation System</h1>", unsafe_allow_html=True)
@@ -128,6 +136,20 @@ st.markdown("<h2 class='header'>Find Your Next Favorite Game!</h2>", unsafe_allo
 st.markdown("<h3 class='subheader'>Describe your ideal game:</h3>", unsafe_allow_html=True)
 user_input = st.text_input("Enter a description (e.g., 'I want a History focussed RPG.')", key="user_input", placeholder="e.g., 'fast-paced multiplayer shooter'")
 
+# Optional filters, applied before ranking
+with st.expander("Filters"):
+    max_price = st.number_input("Max price ($, 0 for free only)", min_value=0.0, value=None, step=5.0)
+    released_after = st.number_input("Released in or after (year)", min_value=1980, max_value=2100, value=None, step=1)
+    genre = st.selectbox("Genre", [''] + get_genre_names())
+filters = {
+    'max_price_cents': round(max_price * 100) if max_price is not None else None,
+    # The input is in dollars, so only US prices are compared with it
+    'currency': 'USD' if max_price is not None else None,
+    'released_after': int(datetime(int(released_after), 1, 1, tzinfo=timezone.utc).timestamp()) if released_after else None,
+    'genre': genre or None,
+}
+filters = {key: value for key, value in filters.items() if value is not None}
+
 # Add a button to trigger recommendations
 col1, col2, col3 = st.columns([2,1,2]) # Centering the button
 with col2:
@@ -136,14 +158,15 @@ with col2:
 if recommend_button and user_input:
     with st.spinner('Finding the best games for you...'):
         st.markdown("<h3 class='subheader' style='margin-top: 2rem;'>Top 5 Recommended Games</h3>", unsafe_allow_html=True)
-        recommendations = recommend_games(user_input, reduced_item_feature_matrix, games_df)
+        recommendations = recommend_games(user_input, filters=filters)
         
-        if not recommendations.size:
+        if not recommendations:
             st.warning("Could not find any recommendations based on your description. Try being more specific or general!")
         else:
-            for idx in recommendations:
-                game_info = games_df.iloc[idx]
-                
+            for game_info in recommendations:
+                # Bundles built with review stats carry each game's review summary
+                reviews = (f"<div class='game-release'><strong>Reviews:</strong> {game_info['review_count']} ({game_info['positive_ratio']:.0%} positive)</div>"
+                           if game_info.get('review_count') else '')
                 # Using st.container to create a card-like structure with custom HTML/CSS
                 st.markdown(f"""
                 <div class='game-card'>
@@ -153,6 +176,7 @@ if recommend_button and user_input:
                     <div class='game-description'><strong>Description:</strong> {game_info['description'][:250] + '...' if len(game_info['description']) > 250 else game_info['description']}</div>
                     <div class='game-price'><strong>Price:</strong> {game_info['price']}</div>
                     <div class='game-release'><strong>Release Date:</strong> {game_info['release_date']}</div>
+                    {reviews}
                 </div>
                 """, unsafe_allow_html=True)
 elif recommend_button and not user_input:
@@ -160,3 +184,5 @@ elif recommend_button and not user_input:
 
 st.markdown("<hr style='margin-top: 3rem; border-top: 1px solid #bdc3c7;'>", unsafe_allow_html=True)
 st.markdown("<p style='text-align:center; color: #7f8c8d; font-size: 0.9em;'>Powered by Trae AI & Streamlit</p>", unsafe_allow_html=True)
+
+serving.log_run(time.perf_counter() - run_start)
@@ -0,0 +1,281 @@
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+
+INDEX_PATH = 'item_index.npz'
+N_PROBE = 8  # inverted lists scanned per query
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 20000  # rows used to train the IVF centroids
+BLOCK_ROWS = 8192  # rows scored per block when assigning vectors to lists
+FILTER_EXACT_ROWS = 20000  # filtered searches matching at most this many items score them all exactly
+NEIGHBOURS = 50  # precomputed neighbours per item
+NEIGHBOUR_BLOCK_ROWS = 256  # items whose neighbours are found per block; scores held are this many rows x all items
+
+
+def normalize(vectors):
+    # Unit-length rows, so cosine similarity is a plain dot product
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _is_store(vectors):
+    # Quantized stores (reduction.QuantizedMatrix) score themselves block by block
+    return hasattr(vectors, 'scores')
+
+
+def _scores(vectors, queries):
+    return vectors.scores(queries) if _is_store(vectors) else queries @ vectors.T
+
+
+def top_k(scores, k):
+    # Row-wise top-k of a 2-D score matrix, best first, in O(n) per row via argpartition
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64), np.empty((scores.shape[0], 0), dtype=scores.dtype)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
+
+
+def score_rows(vectors, queries, rows):
+    # Cosine scores of the queries against ``rows`` (sorted item rows) only, shape (queries, rows)
+    return _scores(vectors[rows], normalize(queries))
+
+
+def search_rows(vectors, queries, rows, k=5):
+    # Exact search restricted to ``rows`` (sorted item rows); returns catalogue rows, -1 padded
+    indices = np.full((len(queries), k), -1, dtype=np.int64)
+    scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    if len(rows):
+        best, best_scores = top_k(score_rows(vectors, queries, rows), k)
+        indices[:, :best.shape[1]] = rows[best]
+        scores[:, :best.shape[1]] = best_scores
+    return indices, scores
+
+
+class ExactIndex:
+    """Brute-force cosine search over pre-normalised vectors or a quantized store."""
+
+    kind = 'exact'
+
+    def __init__(self, vectors, normalized=False):
+        self.vectors = vectors if normalized or _is_store(vectors) else normalize(vectors)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, queries, k=5, allowed=None):
+        # Returns (row indices, cosine scores), each of shape (n_queries, k);
+        # ``allowed`` is an optional boolean mask over the items
+        if allowed is not None:
+            return search_rows(self.vectors, queries, np.flatnonzero(allowed), k)
+        return top_k(_scores(self.vectors, normalize(queries)), k)
+
+    def save(self, path=INDEX_PATH):
+        np.savez(path, kind=self.kind)
+
+
+class IVFIndex:
+    """Inverted-file index: spherical k-means lists, only the closest lists are scanned.
+
+    Row ids are stored grouped by list, so a probed list is one contiguous
+    slice of ``order``. The vectors stay in catalogue order and are never
+    copied, so they can be a read-only memmap. ``n_probe`` trades recall for
+    latency at query time.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, vectors, centroids, order, offsets, n_probe=N_PROBE, normalized=False):
+        vectors = vectors if normalized or _is_store(vectors) else normalize(vectors)
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.vectors = vectors
+        self.n_probe = n_probe
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_probe=N_PROBE, iterations=KMEANS_ITERATIONS, sample=KMEANS_SAMPLE, seed=0):
+        # A quantized store is clustered on its dequantized rows but searched as stored
+        if not _is_store(vectors):
+            vectors = normalize(vectors)
+        n_lists = min(n_lists or max(1, int(4 * math.sqrt(len(vectors)))), len(vectors))
+        rng = np.random.default_rng(seed)
+        train = _float_rows(vectors, rng.choice(len(vectors), min(sample, len(vectors)), replace=False))
+        centroids = _spherical_kmeans(train, n_lists, iterations, rng)
+        assignment = _assign(vectors, centroids)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+        return cls(vectors, centroids, order, offsets, n_probe=n_probe, normalized=True)
+
+    def search(self, queries, k=5, n_probe=None, allowed=None):
+        # A selective filter is cheaper to scan exactly than to probe lists that are mostly filtered out
+        if allowed is not None and np.count_nonzero(allowed) <= FILTER_EXACT_ROWS:
+            return search_rows(self.vectors, queries, np.flatnonzero(allowed), k)
+        queries = normalize(queries)
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        centroid_scores = queries @ self.centroids.T
+        probed_lists, _ = top_k(centroid_scores, n_probe)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for row, lists in enumerate(probed_lists):
+            while True:
+                # Sorted rows keep reads from a memory-mapped matrix sequential
+                candidates = np.sort(np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists]))
+                if allowed is None:
+                    break
+                candidates = candidates[allowed[candidates]]
+                if len(candidates) >= k or len(lists) == len(self.centroids):
+                    break
+                # Too few matching items in the probed lists: probe twice as many, closest first
+                lists = np.argsort(-centroid_scores[row], kind='stable')[:min(2 * len(lists), len(self.centroids))]
+            candidate_scores = _scores(self.vectors[candidates], queries[row:row + 1])[0]
+            best, best_scores = top_k(candidate_scores[None, :], k)
+            indices[row, :best.shape[1]] = candidates[best[0]]
+            scores[row, :best.shape[1]] = best_scores[0]
+        return indices, scores
+
+    def save(self, path=INDEX_PATH):
+        # order holds one entry per item, so it goes to its own .npy that can be memory-mapped
+        np.savez(path, kind=self.kind, centroids=self.centroids, offsets=self.offsets, n_probe=self.n_probe)
+        np.save(order_path(path), self.order)
+
+
+def _float_rows(vectors, rows):
+    return vectors[rows].to_float32() if _is_store(vectors) else vectors[rows]
+
+
+def _assign(vectors, centroids):
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), BLOCK_ROWS):
+        block = _float_rows(vectors, slice(start, start + BLOCK_ROWS))
+        assignment[start:start + BLOCK_ROWS] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+def _spherical_kmeans(vectors, n_clusters, iterations, rng):
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(vectors, centroids)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=n_clusters)
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)])[non_empty]
+        centroids[non_empty] = np.add.reduceat(vectors[order], starts, axis=0)
+        # Empty lists are re-seeded from random vectors
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize(centroids)
+    return centroids
+
+
+def knn_graph(vectors, k=NEIGHBOURS, block_rows=NEIGHBOUR_BLOCK_ROWS, verbose=False):
+    """Top-k cosine neighbours of every item, itself excluded, by blocked matrix multiplies.
+
+    Only ``block_rows`` x n scores exist at any time. Returns (rows as int32,
+    scores as float16), each of shape (n, k), best first.
+    """
+    matrix = vectors.to_float32() if _is_store(vectors) else normalize(vectors)
+    k = min(k, len(matrix) - 1)
+    indices = np.empty((len(matrix), k), dtype=np.int32)
+    scores = np.empty((len(matrix), k), dtype=np.float16)
+    for start in range(0, len(matrix), block_rows):
+        stop = min(start + block_rows, len(matrix))
+        block_scores = matrix[start:stop] @ matrix.T
+        block_scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        indices[start:stop], scores[start:stop] = top_k(block_scores, k)
+        if verbose and (start // block_rows) % 100 == 0:
+            print(f"Neighbours found for {stop} of {len(matrix)} items...")
+    return indices, scores
+
+
+def order_path(path):
+    return os.path.splitext(path)[0] + '.order.npy'
+
+
+def load_index(vectors, path=INDEX_PATH, mmap_mode=None):
+    # The index file only holds the IVF structure; the vectors come from the item matrix
+    try:
+        data = np.load(path)
+    except FileNotFoundError:
+        return ExactIndex(vectors)
+    if str(data['kind']) == IVFIndex.kind:
+        order = data['order'] if 'order' in data else np.load(order_path(path), mmap_mode=mmap_mode)
+        if order.shape[0] != len(vectors):
+            raise ValueError(f"{path} was built for {order.shape[0]} items, the matrix has {len(vectors)}")
+        return IVFIndex(vectors, data['centroids'], order, data['offsets'], n_probe=int(data['n_probe']))
+    return ExactIndex(vectors)
+
+
+def brute_force_search(queries, vectors, k=5):
+    # The original recommend_games path: sklearn cosine similarity plus a full argsort
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    similarities = cosine_similarity(np.atleast_2d(queries), vectors)
+    return similarities.argsort(axis=1)[:, ::-1][:, :k]
+
+
+def benchmark(vectors, queries, k=5, n_probes=(1, 2, 4, 8, 16, 32), ivf=None):
+    """Recall@k and per-query latency of each search path against exact search."""
+
+    def timed(search):
+        latencies, results = [], []
+        for query in queries:
+            start = time.perf_counter()
+            results.append(search(query[None, :])[0])
+            latencies.append((time.perf_counter() - start) * 1000)
+        return np.array(results), np.array(latencies)
+
+    exact = ExactIndex(vectors)
+    truth, exact_ms = timed(lambda query: exact.search(query, k)[0])
+    rows = []
+    _, brute_ms = timed(lambda query: brute_force_search(query, vectors, k))
+    rows.append(('cosine_similarity + argsort', 1.0, brute_ms))
+    rows.append(('exact argpartition', 1.0, exact_ms))
+    ivf = ivf or IVFIndex.build(vectors)
+    for n_probe in n_probes:
+        if n_probe > len(ivf.centroids):
+            break
+        found, ivf_ms = timed(lambda query: ivf.search(query, k, n_probe=n_probe)[0])
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(found, truth)])
+        rows.append((f'ivf n_probe={n_probe} ({len(ivf.centroids)} lists)', recall, ivf_ms))
+    return [(name, recall, float(np.mean(ms)), float(np.percentile(ms, 99))) for name, recall, ms in rows]
+
+
+def format_benchmark(rows, k=5):
+    lines = [f"{'method':<40}{f'recall@{k}':>10}{'mean ms':>10}{'p99 ms':>10}"]
+    lines += [f"{name:<40}{recall:>10.3f}{mean:>10.3f}{p99:>10.3f}" for name, recall, mean, p99 in rows]
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recall@k vs latency of the item index against brute-force search.")
+    parser.add_argument('--matrix', default='reduced_item_feature_matrix.npy', help="item matrix to index")
+    parser.add_argument('--synthetic', type=int, default=0, help="benchmark on this many random clustered vectors instead")
+    parser.add_argument('--dim', type=int, default=768, help="dimension of the synthetic vectors")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        centers = rng.normal(size=(max(1, args.synthetic // 100), args.dim))
+        vectors = (centers[rng.integers(len(centers), size=args.synthetic)] + 0.5 * rng.normal(size=(args.synthetic, args.dim))).astype(np.float32)
+    else:
+        vectors = np.load(args.matrix).astype(np.float32)
+    # Queries are perturbed catalogue items, so no BERT forward pass is needed
+    queries = vectors[rng.choice(len(vectors), args.queries)] + 0.1 * rng.normal(size=(args.queries, vectors.shape[1])).astype(np.float32)
+    print(f"Benchmarking {len(vectors)} x {vectors.shape[1]} items with {args.queries} queries...")
+    print(format_benchmark(benchmark(vectors, queries, k=args.k), k=args.k))